@@ -0,0 +1,349 @@
+"""This module implements an asyncio client to interface the pilight-daemon.
+
+It offers the same features as pilight.Client but all connections are
+served by asyncio streams, thus many clients can share one event loop
+without a thread per connection and without polling sockets.
+"""
+
+import asyncio
+import collections
+import logging
+
+from pilight import codec, pilight
+
+
+class AsyncClient(object):
+
+    """Asyncio client for the pilight-daemon (https://www.pilight.org/).
+
+    The client has to be connected with connect() or by using it as an
+    async context manager. Received codes are either handled by a callback
+    in run() or consumed by async iteration over the client:
+
+        async with AsyncClient() as client:
+            await client.send_code({"protocol": ["kaku_switch"], ...})
+            async for code in client:
+                print(code)
+
+    :param host: Address where the pilight-daemon intance runs
+    :param port: Port of the pilight-daemon on the host
+    :param timeout: Time until a time out exception is raised when connecting
+    or when waiting for an acknowledgement
+    :param recv_ident: The identification of the receiver to sucribe
+    to the pilight-daemon topics (https://manual.pilight.org/en/api)
+    :param recv_codes_only: If True: only return codes the pilight-daemon
+    received, not status messages etc.
+    :param veto_repeats: If True: only return new codes, not the same code
+    repeated.
+    :param heartbeat_interval: Seconds between heartbeats to check the
+    connection to the pilight-daemon. None disables the heartbeat.
+    :param dedupe_window: Seconds within an identical code is a repeat,
+    see pilight.Client
+    :param dedupe_size: Maximum number of codes remembered for dedupe_window
+    :param connect_timeout: Time until a time out exception is raised when
+    connecting, default is timeout
+    :param prefilter: Drop received frames by inspecting their bytes before
+    decoding them, see pilight.Client
+    """
+
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+
+    # Maximum size of a message in bytes, longer messages are skipped
+    LINE_LIMIT = 2 ** 20
+
+    def __init__(self, host='127.0.0.1', port=5000, timeout=1,
+                 recv_ident=None, recv_codes_only=True, veto_repeats=True,
+                 heartbeat_interval=1, dedupe_window=None, dedupe_size=1024,
+                 connect_timeout=None, prefilter=None):
+        """Initialize the pilight client.
+
+        No connection is opened until connect() is awaited.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        self.recv_ident = recv_ident
+        self.recv_codes_only = recv_codes_only
+        self.veto_repeats = veto_repeats
+        self.heartbeat_interval = heartbeat_interval
+        self.prefilter = prefilter
+        self._repeat_cache = None
+        if dedupe_window:
+            self._repeat_cache = pilight.RepeatCache(dedupe_window,
+                                                     dedupe_size)
+
+        self.callback = None
+
+        self._sender = None  # (reader, writer) of the sender connection
+        self._receiver = None  # (reader, writer) of the receiver connection
+        # Futures of send actions waiting for the daemon status reply,
+        # the daemon answers in order. None for not acknowledged sends.
+        self._acknowledges = collections.deque()
+        self._beat = None  # Future of the pending heartbeat reply
+        self._tasks = []
+        self._closed = True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def connect(self):
+        """Open and identify the sender and receiver connection.
+
+        Both connections are established concurrently.
+        """
+        connections = await asyncio.gather(
+            self._connect(pilight.SENDER_IDENTIFICATION_FRAME),
+            self._connect(codec.encode(self.recv_ident) if self.recv_ident
+                          else pilight.RECEIVER_IDENTIFICATION_FRAME),
+            return_exceptions=True)
+        failed = [connection for connection in connections
+                  if isinstance(connection, BaseException)]
+        if failed:
+            for connection in connections:
+                if not isinstance(connection, BaseException):
+                    connection[1].close()
+            raise failed[0]
+        self._sender, self._receiver = connections
+        self._closed = False
+        self._tasks = [asyncio.ensure_future(self._read_sender())]
+        if self.heartbeat_interval:
+            self._tasks.append(asyncio.ensure_future(self._heartbeat()))
+
+    async def _connect(self, identification):
+        """Return reader and writer of a connection identified with the
+        encoded identification."""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port,
+                                        limit=self.LINE_LIMIT),
+                self.connect_timeout)
+        except asyncio.TimeoutError:
+            raise IOError('Connection to the pilight daemon timed out')
+        writer.write(identification)
+        try:
+            answer = codec.loads(
+                await self._read_line(reader, self.connect_timeout))
+        except (IOError, ValueError, asyncio.TimeoutError):
+            answer = None
+        # Check connections are acknowledged
+        if not isinstance(answer, dict) or \
+                'success' not in answer.get('status', ''):
+            writer.close()
+            raise IOError(
+                'Connection to the pilight daemon failed. Reply %s', answer)
+        return reader, writer
+
+    @staticmethod
+    async def _read_line(reader, timeout=None):
+        """Return the next non empty line, messages can be separated by
+        empty lines. Lines longer than the limit of the reader are skipped.
+        """
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+            except ValueError:  # Limit overrun, the reader dropped the data
+                logging.debug('Skipping too long message of the pilight '
+                              'daemon')
+                continue
+            if not line:
+                raise IOError('Connection to the pilight daemon lost')
+            line = line.strip()
+            if line:
+                return line
+
+    async def close(self):
+        """Close all connections to the pilight-daemon."""
+        self._closed = True
+        self._fail_pending(IOError('Client closed'))
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for connection in (self._sender, self._receiver):
+            if connection:
+                connection[1].close()
+
+    def _fail_pending(self, exception):
+        while self._acknowledges:
+            future = self._acknowledges.popleft()
+            if future and not future.done():
+                future.set_exception(exception)
+        if self._beat and not self._beat.done():
+            self._beat.set_exception(exception)
+
+    async def _read_sender(self):
+        """Resolve acknowledgements and heartbeats of the sender connection."""
+        try:
+            while True:
+                line = await self._read_line(self._sender[0])
+                if line.startswith(b'BEAT'):
+                    if self._beat and not self._beat.done():
+                        self._beat.set_result(True)
+                    continue
+                try:
+                    answer = codec.loads(line)
+                except ValueError:
+                    logging.debug('Cannot decode sender reply %s', line)
+                    continue
+                if not isinstance(answer, dict) or not self._acknowledges:
+                    logging.debug('Unexpected sender reply %s', answer)
+                    continue
+                future = self._acknowledges.popleft()
+                if future and not future.done():
+                    future.set_result(answer.get('status') == 'success')
+        except IOError as exception:
+            logging.debug('Pilight sender connection lost')
+            self._fail_pending(exception)
+
+    async def _heartbeat(self):
+        """Check the connection by sending a heartbeat periodically."""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self._beat = loop.create_future()
+            self._sender[1].write(b'HEART\n')
+            try:
+                await asyncio.wait_for(self._beat, self.timeout)
+            except (IOError, asyncio.TimeoutError):
+                logging.debug('Heartbeat lost, closing connection')
+                self._fail_pending(IOError('Heartbeat lost'))
+                for connection in (self._sender, self._receiver):
+                    connection[1].close()
+                return
+
+    def set_callback(self, function):
+        """Function or coroutine function to be called on received data."""
+        self.callback = function
+
+    async def send_code(self, data, acknowledge=True):
+        """Send a RF code known to the pilight-daemon.
+
+        For protocols look at https://manual.pilight.org/en/api.
+        :param data: Dictionary with the data
+        :param acknowledge: Raise IO exception if the code is not
+        send by the pilight-deamon
+        """
+        if "protocol" not in data:
+            raise ValueError(
+                'Pilight data to send does not contain a protocol info. '
+                'Check the pilight-send doku!', str(data))
+        if self._closed:
+            raise IOError('Client is not connected')
+
+        message = {
+            "action": "send",  # Tell pilight daemon to send the data
+            "code": data,
+        }
+
+        future = None
+        if acknowledge:
+            future = asyncio.get_event_loop().create_future()
+        # Reply has to be consumed also if not acknowledged
+        self._acknowledges.append(future)
+        self._sender[1].write(codec.encode(message))
+        await self._sender[1].drain()
+
+        if acknowledge:
+            try:
+                received = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                received = False
+            if not received:
+                raise IOError('Send code failed. Code: %s', str(data))
+
+    async def receive(self):
+        """Return the next received message that passes the filter."""
+        prefilter = self.prefilter
+        if prefilter is None:  # Decoding natively is faster
+            prefilter = codec.name not in codec.NATIVE
+        while True:
+            line = await self._read_line(self._receiver[0])
+            if prefilter and not pilight._prefilter(  # pylint: disable=protected-access
+                    line, self.recv_codes_only, self.veto_repeats,
+                    self._repeat_cache):
+                continue
+            try:
+                message_dict = codec.loads(line)
+            except ValueError:
+                logging.debug('Cannot decode received message %s', line)
+                continue
+            if not isinstance(message_dict, dict):
+                logging.debug('Unexpected received message %s', line)
+                continue
+            if pilight._filter_message(  # pylint: disable=protected-access
+                    message_dict, self.recv_codes_only, self.veto_repeats,
+                    self._repeat_cache):
+                return message_dict
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.receive()
+        except IOError:
+            if self._closed:
+                raise StopAsyncIteration
+            raise
+
+    async def run(self):
+        """Call the callback on received data until the client is closed."""
+        if not self.callback:
+            raise RuntimeError('No callback function set, cancel readout')
+        logging.debug('Pilight receiver started')
+        async for message_dict in self:
+            result = self.callback(message_dict)
+            if asyncio.iscoroutine(result):
+                await result
+        logging.debug('Pilight receiver stopped')
+
+
+async def codes(client, timeout=None):
+    """Yield the codes received by a threaded pilight.Client.
+
+    The client needs a queue_size. Waiting does not block the event loop.
+
+        async for code in aio.codes(client):
+            print(code)
+
+    :param client: Started pilight.Client
+    :param timeout: Seconds to wait for a code, None waits forever.
+    The iteration ends on timeout and when the client is stopped.
+    """
+    buffer = client.buffer
+    if buffer is None:
+        raise RuntimeError('Received codes are not buffered')
+    loop = asyncio.get_event_loop()
+
+    def wake(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def wake_threadsafe(waiter):
+        try:
+            loop.call_soon_threadsafe(wake, waiter)
+        except RuntimeError:  # Loop closed meanwhile
+            pass
+
+    while True:
+        received = buffer.get(1, 0)
+        if received:
+            yield received[0]
+            continue
+        if buffer.closed:
+            return
+        waiter = loop.create_future()
+        buffer.add_waiter(lambda waiter=waiter: wake_threadsafe(waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return
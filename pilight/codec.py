@@ -0,0 +1,71 @@
+"""This module implements the JSON codec of the pilight messages.
+
+The fastest installed JSON library is used: orjson, ujson or the json
+module of the standard library. All functions take and return bytes,
+thus no intermediate strings are created. The codec can be changed with
+use().
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode()
+
+
+def _json_loads(data):
+    return json.loads(data.decode())
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj).encode()
+
+
+# Codec name: (dumps, loads)
+CODECS = {'json': (_json_dumps, _json_loads)}
+if ujson is not None:
+    CODECS['ujson'] = (_ujson_dumps, ujson.loads)
+if orjson is not None:
+    CODECS['orjson'] = (orjson.dumps, orjson.loads)
+
+# Codecs that decode a frame faster than its bytes can be inspected in
+# python, frames are not prefiltered before they are decoded with them
+NATIVE = ('orjson', )
+
+name = None  # pylint: disable=invalid-name
+dumps = None  # pylint: disable=invalid-name
+loads = None  # pylint: disable=invalid-name
+
+
+def use(codec=None):
+    """Use the JSON library of the name, default is the fastest installed.
+
+    dumps(obj) returns bytes, loads(data) takes bytes and raises ValueError
+    for invalid data.
+    """
+    global name, dumps, loads  # pylint: disable=global-statement,invalid-name
+    if codec is None:
+        codec = next(codec for codec in ('orjson', 'ujson', 'json')
+                     if codec in CODECS)
+    if codec not in CODECS:
+        raise ValueError('JSON codec %s is not available' % codec)
+    dumps, loads = CODECS[codec]
+    name = codec
+
+
+def encode(message):
+    """Return the encoded new line terminated message."""
+    return dumps(message) + b'\n'
+
+
+use()
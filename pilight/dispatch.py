@@ -0,0 +1,352 @@
+"""This module implements the dispatch of received messages to callbacks.
+
+The callback is called in a pool of worker threads that is fed by a
+bounded queue. Thus slow callbacks do not stall reading the socket of the
+pilight-daemon. What happens if the queue is full is defined by an
+overflow policy.
+
+CPU heavy handlers are limited to one core by the interpreter lock,
+thus they can be called in a pool of worker processes instead.
+"""
+
+import collections
+import logging
+import multiprocessing
+import threading
+import time
+
+from pilight import pilight
+
+# Overflow policies
+BLOCK = 'block'  # Wait until there is space in the queue
+DROP_OLDEST = 'drop_oldest'  # Drop the oldest queued message
+DROP_NEWEST = 'drop_newest'  # Drop the new message
+# Replace a queued message of the same device by the new one,
+# drop the oldest message if no message of the device is queued
+COALESCE = 'coalesce'
+
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+class Dispatcher(object):
+
+    """Call a handler for messages in a pool of worker threads.
+
+    Set it as dispatcher of a pilight.Client to call the callback in
+    the worker threads. With more than one worker the messages can be
+    handled out of order.
+
+    :param workers: Number of worker threads
+    :param maxsize: Maximum number of queued messages
+    :param policy: What to do if the queue is full, one of POLICIES
+    :param key: Function returning the device of a message, used to
+    coalesce messages of the same device
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, workers=1, maxsize=1000, policy=BLOCK,
+                 key=pilight.device_key):
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy %s' % policy)
+        if workers < 1 or maxsize < 1:
+            raise ValueError('Need at least one worker and queue entry')
+        self.workers = workers
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key = key
+
+        # Counters
+        self.submitted = 0  # Messages accepted
+        self.dropped = 0  # Messages dropped due to a full queue
+        self.coalesced = 0  # Messages replaced by a newer one
+        self.errors = 0  # Exceptions raised by the handler
+
+        self._handler = None
+        # Queued messages. For COALESCE the queue holds the device keys
+        # and the messages are stored per key.
+        self._queue = collections.deque()
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = True
+
+    def __len__(self):
+        """Number of queued messages."""
+        return len(self._queue)
+
+    def start(self, handler):
+        """Start the worker threads calling handler(message)."""
+        self._handler = handler
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._work,
+                                          name='dispatcher-%d' % i)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker threads after the queued messages are handled."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self._threads = []
+
+    def submit(self, message):
+        """Queue a message for the handler.
+
+        :returns: False if the message was dropped
+        """
+        with self._condition:
+            if self._stopped:
+                return False
+            if self.policy == COALESCE:
+                key = self.key(message)
+                if key in self._pending:
+                    self._pending[key] = message
+                    self.coalesced += 1
+                    return True
+            if len(self._queue) >= self.maxsize:
+                if self.policy == BLOCK:
+                    while (len(self._queue) >= self.maxsize and
+                           not self._stopped):
+                        self._condition.wait()
+                    if self._stopped:
+                        return False
+                elif self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    self._pop()
+                    self.dropped += 1
+            if self.policy == COALESCE:
+                self._pending[key] = message
+                self._queue.append(key)
+            else:
+                self._queue.append(message)
+            self.submitted += 1
+            self._condition.notify_all()
+        return True
+
+    def _pop(self):
+        """Return the oldest queued message, lock has to be acquired."""
+        if self.policy == COALESCE:
+            return self._pending.pop(self._queue.popleft())
+        return self._queue.popleft()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if not self._queue:  # Stopped and all messages handled
+                    return
+                message = self._pop()
+                self._condition.notify_all()  # Space for blocked submits
+            try:
+                self._handler(message)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Callback failed for message %s', message)
+                with self._condition:
+                    self.errors += 1
+
+
+def _process(handler, tasks, results, feed_back):
+    """Call the handler for the batches of messages of the task queue,
+    runs in a worker process."""
+    while True:
+        batch = tasks.get()
+        if batch is None:  # Stopped
+            results.put((None, 0, []))
+            return
+        errors, replies = 0, []
+        for message in batch:
+            try:
+                reply = handler(message)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Handler failed for message %s', message)
+                errors += 1
+                continue
+            if feed_back and reply is not None:
+                replies.append(reply)
+        results.put((len(batch), errors, replies))
+
+
+class ProcessDispatcher(object):
+
+    """Call a handler for messages in a pool of worker processes.
+
+    Messages are send to the processes in batches, thus the cost of the
+    inter-process communication is shared by many messages. All messages
+    of a device are handled by the same process in order. If the result of
+    the handler is fed back, results that are not None are passed to the
+    callback of the client in the main process. Thus the handler can turn
+    received codes into events.
+
+        def detect(message):  # Module level to be picklable
+            ...
+        dispatcher = dispatch.ProcessDispatcher(detect, results=True)
+        client = pilight.Client(dispatcher=dispatcher)
+
+    :param handler: Function called with a message in a worker process.
+    It is pickled, thus it has to be defined at module level.
+    :param processes: Number of worker processes, default is the number
+    of cores
+    :param batch_size: Maximum number of messages send at once
+    :param batch_wait: Seconds a message waits for its batch to fill
+    :param maxsize: Maximum number of queued batches per process, submit
+    waits if the queue of the process is full
+    :param results: Pass the results of the handler to the callback
+    :param key: Function returning the device of a message, the messages
+    of a device are handled in order
+    :param context: multiprocessing context, default is forkserver or
+    spawn where forkserver is not available. The workers are started by
+    the receiver thread, forking it could copy locks held by the other
+    threads of the client.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(self, handler, processes=None, batch_size=100,
+                 batch_wait=0.01, maxsize=100, results=False,
+                 key=pilight.device_key, context=None):
+        self.handler = handler
+        self.processes = processes or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.maxsize = maxsize
+        self.results = results
+        self.key = key
+        if context is None:
+            context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in
+                multiprocessing.get_all_start_methods() else 'spawn')
+        self._context = context
+
+        # Counters
+        self.submitted = 0  # Messages accepted
+        self.handled = 0  # Messages handled by the processes
+        self.errors = 0  # Exceptions raised by the handler
+
+        self._callback = None
+        self._batches = [[] for _ in range(self.processes)]
+        self._since = [0.] * self.processes  # Time of the first message
+        self._pending = 0  # Messages submitted but not handled yet
+        self._condition = threading.Condition()
+        self._tasks = []
+        self._results_queue = None
+        self._workers = []
+        self._threads = []
+        self._stopped = True
+
+    def __len__(self):
+        """Number of messages not handled yet."""
+        return self._pending
+
+    def start(self, callback=None):
+        """Start the worker processes, callback(result) is called with the
+        results of the handler if they are fed back."""
+        self._callback = callback
+        self._results_queue = self._context.Queue()
+        self._tasks = [self._context.Queue(self.maxsize)
+                       for _ in range(self.processes)]
+        self._workers = [self._context.Process(
+            target=_process, name='dispatcher-%d' % i,
+            args=(self.handler, tasks, self._results_queue, self.results))
+                         for i, tasks in enumerate(self._tasks)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._send_batches,
+                                          name='dispatcher-batches'),
+                         threading.Thread(target=self._collect,
+                                          name='dispatcher-results')]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker processes after the queued messages are
+        handled."""
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._threads, self._workers = [], []
+
+    def submit(self, message):
+        """Queue a message for the handler.
+
+        :returns: False if the dispatcher is stopped
+        """
+        with self._condition:
+            if self._stopped:
+                return False
+            process = hash(self.key(message)) % self.processes
+            batch = self._batches[process]
+            if not batch:
+                self._since[process] = time.monotonic()
+                self._condition.notify_all()  # Start the batch timer
+            batch.append(message)
+            self.submitted += 1
+            self._pending += 1
+            if len(batch) >= self.batch_size:
+                # Send under the lock to keep the batches in order
+                self._send(process)
+        return True
+
+    def _send(self, process):
+        """Send the batch of the process, lock has to be acquired."""
+        batch, self._batches[process] = self._batches[process], []
+        self._tasks[process].put(batch)
+
+    def _send_batches(self):
+        """Send the batches that waited batch_wait."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for process, batch in enumerate(self._batches):
+                    if not batch:
+                        continue
+                    due = self._since[process] + self.batch_wait - now
+                    if due <= 0 or self._stopped:
+                        self._send(process)
+                    elif wait is None or due < wait:
+                        wait = due
+                if self._stopped:
+                    for tasks in self._tasks:
+                        tasks.put(None)
+                    return
+                self._condition.wait(wait)
+
+    def _collect(self):
+        """Count the handled messages and pass the results to the
+        callback."""
+        stopped = 0
+        while stopped < self.processes:
+            handled, errors, replies = self._results_queue.get()
+            if handled is None:
+                stopped += 1
+                continue
+            with self._condition:
+                self._pending -= handled
+                self.handled += handled
+                self.errors += errors
+            if self._callback is None:
+                continue
+            for reply in replies:
+                try:
+                    self._callback(reply)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception('Callback failed for result %s', reply)
@@ -0,0 +1,149 @@
+"""This module implements the metrics of the pilight clients.
+
+Counters, gauges and latency histograms are updated by the client while
+it sends and receives. A snapshot is a copy of plain dictionaries, thus
+it can be taken often. It can also be exported in the Prometheus text
+format for scraping.
+"""
+
+import bisect
+import threading
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# Metric name: help text
+DESCRIPTIONS = {
+    'bytes_received': 'Bytes received from the pilight-daemon',
+    'bytes_sent': 'Bytes send to the pilight-daemon',
+    'messages_received': 'Messages decoded on the receiver connection',
+    'decode_errors': 'Frames dropped since they are no JSON objects',
+    'messages_skipped': 'Frames dropped by the filter without decoding',
+    'codes_sent': 'Codes send to the pilight-daemon',
+    'codes_coalesced': 'Scheduled codes replaced by a newer code of the device',
+    'acks_failed': 'Codes not acknowledged by the pilight-daemon',
+    'heartbeats_lost': 'Heartbeats without reply of the pilight-daemon',
+    'replies_lost': 'Actions without reply of the pilight-daemon in time',
+    'reconnects': 'Reconnections to the pilight-daemon',
+    'outbox_expired': 'Sends dropped since the connection was lost too long',
+    'ack_seconds': 'Round trip time of send acknowledgements',
+    'connect_seconds': 'Time to connect to the pilight-daemon',
+    'decode_seconds': 'Time to decode the messages of one receive',
+    'callback_seconds': 'Time of the callbacks of one message',
+    'pending_acks': 'Send actions waiting for the reply of the daemon',
+    'queue_depth': 'Messages waiting in the dispatcher queue',
+    'outbox': 'Sends waiting for the reconnect',
+    'scheduled': 'Codes waiting in the send scheduler',
+    'buffered': 'Received codes waiting in the buffer',
+    'buffer_dropped': 'Received codes dropped since the buffer was full',
+}
+
+
+class Histogram(object):
+
+    """Histogram of observed values with fixed buckets.
+
+    :param buckets: Sorted upper bounds of the buckets
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last bucket is +Inf
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """Return the cumulative bucket counts, the sum and the count."""
+        cumulative, buckets = 0, []
+        for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+class Metrics(object):
+
+    """Counters, gauges and histograms of a client.
+
+        client = pilight.Client()
+        ...
+        print(client.metrics.snapshot()['counters']['reconnects'])
+        print(client.metrics.prometheus())
+
+    :param buckets: Upper bounds of the histogram buckets in seconds
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._gauges = {}  # Name: function returning the current value
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        """Increase the counter of the name."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Add a value to the histogram of the name."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def gauge(self, name, function):
+        """Set the function returning the current value of the gauge.
+
+        It is only called for snapshots, thus it costs nothing while
+        sending and receiving.
+        """
+        with self._lock:
+            self._gauges[name] = function
+
+    def snapshot(self):
+        """Return a copy of all metrics as dictionaries."""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict((name, histogram.snapshot()) for name, histogram
+                              in self._histograms.items())
+        return {'counters': counters,
+                'gauges': dict((name, function())
+                               for name, function in gauges.items()),
+                'histograms': histograms}
+
+    def prometheus(self, prefix='pilight'):
+        """Return all metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def header(name, metric, metric_type):
+            if metric in DESCRIPTIONS:
+                lines.append('# HELP %s %s' % (name, DESCRIPTIONS[metric]))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+
+        for metric, value in sorted(snapshot['counters'].items()):
+            name = '%s_%s_total' % (prefix, metric)
+            header(name, metric, 'counter')
+            lines.append('%s %s' % (name, value))
+        for metric, value in sorted(snapshot['gauges'].items()):
+            name = '%s_%s' % (prefix, metric)
+            header(name, metric, 'gauge')
+            lines.append('%s %s' % (name, value))
+        for metric, histogram in sorted(snapshot['histograms'].items()):
+            name = '%s_%s' % (prefix, metric)
+            header(name, metric, 'histogram')
+            for bound, count in histogram['buckets']:
+                bound = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{le="%s"} %d' % (name, bound, count))
+            lines.append('%s_sum %r' % (name, histogram['sum']))
+            lines.append('%s_count %d' % (name, histogram['count']))
+        return '\n'.join(lines) + '\n'
@@ -7,7 +7,568 @@ import threading
 import socket
 import json
 import logging
+import math
+import random
+import re
+import select
+import selectors
 import time
+import collections
+import functools
+from concurrent import futures
+
+from pilight import codec, profiling, validators
+from pilight.metrics import Metrics
+
+# Modes of the client, which connections are opened
+MODE_SEND = 'send'
+MODE_RECEIVE = 'receive'
+MODE_BOTH = 'both'
+
+# Connection states of the client
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+
+# Actions of the pilight API: message of their reply, other actions are
+# replied with a status
+REQUEST_REPLIES = {
+    "request values": "values",
+    "request config": "config",
+}
+
+# Identification of the sender connection (https://manual.pilight.org/en/api)
+SENDER_IDENTIFICATION = {
+    "action": "identify",
+    "options": {
+        # To get CPU load and RAM of pilight daemon, is neverless
+        # ignored by daemon ...
+        "core": 0,
+        "receiver": 0,  # To receive the RF data received by pilight
+        "config": 0
+    }
+}
+# Encoded once, it is send on each connect
+SENDER_IDENTIFICATION_FRAME = codec.encode(SENDER_IDENTIFICATION)
+
+# Default identification of the receiver connection
+RECEIVER_IDENTIFICATION = {
+    "action": "identify",
+    "options": {
+        "core": 0,  # To get CPU load and RAM of pilight daemon
+        # To receive the RF data received by pilight
+        "receiver": 1,
+        "config": 0,
+        "forward": 0
+    }
+}
+RECEIVER_IDENTIFICATION_FRAME = codec.encode(RECEIVER_IDENTIFICATION)
+# Requests of the device states of a state store
+REQUEST_STATES_FRAME = (codec.encode({"action": "request config"}) +
+                        codec.encode({"action": "request values"}))
+
+
+def _filter_message(message_dict, recv_codes_only, veto_repeats,
+                    repeat_cache=None):
+    """Return True if a received message has to be passed to the callback.
+
+    :param message_dict: Decoded message of the pilight-daemon
+    :param recv_codes_only: Only pass messages with receiver origin
+    :param veto_repeats: Only pass the first message of repeated codes,
+    is only used when recv_codes_only is set
+    :param repeat_cache: RepeatCache to detect repeated codes, otherwise
+    the repeats counter of the daemon is used
+    """
+    if not recv_codes_only:
+        return True
+    # Filter: Only use receiver messages
+    if 'receiver' not in message_dict.get('origin', ''):
+        return False
+    if veto_repeats:
+        if repeat_cache is not None:
+            return not repeat_cache.is_repeat(message_dict)
+        return message_dict.get('repeats') == 1
+    return True
+
+
+# Top level and nested "repeats" keys of a raw frame
+_REPEATS = re.compile(br'"repeats"\s*:\s*(-?\d+)')
+
+
+def _prefilter(frame, recv_codes_only, veto_repeats, repeat_cache=None):
+    """Return False if a raw frame is certainly dropped by _filter_message.
+
+    Only the bytes are inspected, thus the frames of other origins and the
+    repeats 2..N of the daemon are dropped without decoding them. Frames
+    that cannot be judged from the bytes, e.g. with escaped characters,
+    pass and are decided after decoding.
+
+    :param frame: Raw frame of the pilight-daemon
+    """
+    if not recv_codes_only or b'\\u' in frame:
+        return True
+    if b'receiver' not in frame:
+        return False
+    if veto_repeats and repeat_cache is None:
+        repeats = _REPEATS.findall(frame)
+        if not repeats:  # Repeats missing
+            return False
+        if len(repeats) == 1:  # Nested repeats are dropped anyway
+            return repeats[0] == b'1'
+    return True
+
+
+def _prefilter_states(prefilter, frame):
+    """Prefilter only the received codes, the other frames can update the
+    device states."""
+    return b'receiver' not in frame or prefilter(frame)
+
+
+class RepeatCache(object):
+
+    """Time windowed cache to detect repeated codes.
+
+    A code is a repeat if an identical code was seen within the window,
+    independent of the repeats counter of the daemon. Thus a code is not
+    lost if its first frame was not received and the same code received
+    by several receivers is passed only once. Every repeat restarts the
+    window, thus holding a button results in one code.
+
+    :param window: Seconds after the last identical code a code is a repeat
+    :param maxsize: Maximum number of cached codes, the least recently seen
+    codes are evicted
+    """
+
+    def __init__(self, window=0.5, maxsize=1024):
+        self.window = window
+        self.maxsize = maxsize
+        self._seen = collections.OrderedDict()  # Key: time last seen
+
+    def __len__(self):
+        return len(self._seen)
+
+    @staticmethod
+    def key(message_dict):
+        """Return the canonical key of the protocol and the message."""
+        return (message_dict.get('protocol'),
+                json.dumps(message_dict.get('message'), sort_keys=True))
+
+    def is_repeat(self, message_dict, now=None):
+        """Return True if an identical code was seen within the window.
+
+        The code is remembered as seen now.
+        """
+        if now is None:
+            now = time.time()
+        key = self.key(message_dict)
+        last_seen = self._seen.pop(key, None)
+        self._seen[key] = now
+        # Oldest entries are first, remove the expired and the least recent
+        while self._seen:
+            oldest_key, oldest_seen = next(iter(self._seen.items()))
+            if (len(self._seen) <= self.maxsize and
+                    now - oldest_seen <= self.window):
+                break
+            del self._seen[oldest_key]
+        return last_seen is not None and now - last_seen <= self.window
+
+
+def _wait_readable(client_socket, timeout):
+    """Wait until data can be read from the socket.
+
+    Poll is used since select fails for file descriptors above 1023.
+
+    :param timeout: Seconds to wait, None waits forever
+    :returns: True if data can be read, False on timeout
+    """
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(client_socket, select.POLLIN)
+        return bool(poller.poll(None if timeout is None
+                                else int(math.ceil(timeout * 1000))))
+    with selectors.DefaultSelector() as selector:  # Windows has no poll
+        selector.register(client_socket, selectors.EVENT_READ)
+        return bool(selector.select(timeout))
+
+
+def device_key(message_dict):
+    """Return the key (protocol, id, unit) of the device of a message.
+
+    Works for received messages, which have the device data in the
+    nested message, as well as for codes to send. Protocols given as
+    list with one entry are unpacked.
+    """
+    code = message_dict.get('message')
+    if not isinstance(code, dict):
+        code = message_dict
+    protocol = message_dict.get('protocol', code.get('protocol'))
+    if isinstance(protocol, list):
+        protocol = protocol[0] if len(protocol) == 1 else tuple(protocol)
+    return protocol, code.get('id'), code.get('unit')
+
+
+class Subscriptions(object):
+
+    """Index of callbacks subscribed to codes of certain devices.
+
+    Subscriptions are indexed by the fields they filter for, thus finding
+    the callbacks of a message takes one dictionary lookup per used
+    combination of fields, independent of the number of subscriptions.
+    Subscriptions can be changed while messages are matched.
+    """
+
+    FIELDS = ('protocol', 'id', 'unit', 'origin')
+
+    def __init__(self):
+        # Used fields (mask) -> field values -> callbacks
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(callbacks) for keys in self._index.values()
+                   for callbacks in keys.values())
+
+    @staticmethod
+    def _fields(message_dict):
+        protocol, device_id, unit = device_key(message_dict)
+        return protocol, device_id, unit, message_dict.get('origin')
+
+    def add(self, callback, **filters):
+        """Subscribe callback to messages matching all filters.
+
+        :param filters: Values of FIELDS the messages have to match,
+        None matches all values
+        :returns: Handle to remove the subscription
+        """
+        unknown = set(filters) - set(self.FIELDS)
+        if unknown:
+            raise ValueError('Cannot filter for %s' % ', '.join(unknown))
+        values = tuple(filters.get(field) for field in self.FIELDS)
+        mask = tuple(value is not None for value in values)
+        key = tuple(value for value in values if value is not None)
+        with self._lock:  # Copy on write, matching does not need the lock
+            index = dict(self._index)
+            keys = dict(index.get(mask, {}))
+            keys[key] = keys.get(key, ()) + (callback, )
+            index[mask] = keys
+            self._index = index
+        return mask, key, callback
+
+    def remove(self, handle):
+        """Remove the subscription of the handle returned by add()."""
+        mask, key, callback = handle
+        with self._lock:
+            index = dict(self._index)
+            keys = dict(index.get(mask, {}))
+            callbacks = list(keys.get(key, ()))
+            if callback not in callbacks:
+                raise ValueError('Subscription does not exist')
+            callbacks.remove(callback)
+            if callbacks:
+                keys[key] = tuple(callbacks)
+            else:
+                del keys[key]
+            if keys:
+                index[mask] = keys
+            else:
+                del index[mask]
+            self._index = index
+
+    def match(self, message_dict):
+        """Return the callbacks subscribed to the message."""
+        index = self._index
+        if not index:
+            return []
+        fields = self._fields(message_dict)
+        callbacks = []
+        for mask, keys in index.items():
+            key = tuple(value for value, used in zip(fields, mask) if used)
+            callbacks.extend(keys.get(key, ()))
+        return callbacks
+
+
+class CodeBuffer(object):
+
+    """Bounded buffer of received codes for consumers in other threads.
+
+    If the buffer is full the oldest code is dropped, thus a slow consumer
+    does not block the receiver thread.
+
+    :param maxsize: Maximum number of buffered codes
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.dropped = 0  # Codes dropped due to a full buffer
+        self._codes = collections.deque()
+        self._condition = threading.Condition()
+        self._waiters = []  # Functions called on the next put
+        self._closed = False
+
+    def __len__(self):
+        return len(self._codes)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, code):
+        with self._condition:
+            if self._closed:
+                return
+            if len(self._codes) >= self.maxsize:
+                self._codes.popleft()
+                self.dropped += 1
+            self._codes.append(code)
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter()
+
+    def _take(self, max_n):
+        return [self._codes.popleft()
+                for _ in range(min(max_n, len(self._codes)))]
+
+    def get(self, max_n=1, timeout=None):
+        """Return up to max_n codes, wait up to timeout seconds for one.
+
+        :returns: List of codes, empty on timeout or if closed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._codes or self._closed,
+                                     timeout)
+            return self._take(max_n)
+
+    def get_batch(self, max_n, max_wait=None):
+        """Return up to max_n codes, wait up to max_wait seconds until
+        max_n codes are buffered.
+
+        :returns: List of codes, can be empty
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: len(self._codes) >= max_n or self._closed, max_wait)
+            return self._take(max_n)
+
+    def add_waiter(self, function):
+        """Call the function once a code is buffered or the buffer is
+        closed, e.g. to wake up an event loop."""
+        with self._condition:
+            if not self._codes and not self._closed:
+                self._waiters.append(function)
+                return
+        function()
+
+    def close(self):
+        """Wake up all consumers, no more codes are buffered."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter()
+
+
+class MessageDecoder(object):
+
+    """Incremental decoder of the new line delimited pilight message stream.
+
+    Socket data is fed in chunks of arbitrary size. Messages split between
+    chunks are kept in a carry-over buffer until they are complete, thus
+    only complete messages are returned and none are lost.
+
+    Socket data can be received directly into the reused buffer of the
+    decoder (receive()), the complete frames are split in one go, thus
+    no intermediate objects are created per received chunk.
+
+    :param max_frame_size: Maximum size in bytes of an incomplete message,
+    a larger carry-over buffer is discarded to protect against unterminated
+    streams
+    :param skip_heartbeats: Drop heartbeat replies (BEAT) silently instead
+    of counting them as errors
+    :param buffer_size: Initial size of the receive buffer in bytes
+    :param profiler: profiling.Profiler timing the read and the framing
+    """
+
+    # Minimum free space of the buffer for a receive
+    MIN_FREE = 1024
+
+    def __init__(self, max_frame_size=1048576, skip_heartbeats=False,
+                 buffer_size=4096, profiler=None):
+        self.max_frame_size = max_frame_size
+        self.skip_heartbeats = skip_heartbeats
+        self.profiler = profiler
+        self.errors = 0  # Number of dropped frames
+        self.skipped = 0  # Number of frames skipped by the prefilter
+        self._data = bytearray(buffer_size)
+        self._view = memoryview(self._data)
+        self._start = 0  # Begin of the incomplete frame in the buffer
+        self._end = 0  # End of the data in the buffer
+        self._frames = collections.deque()  # Complete frames
+
+    def _reserve(self, size):
+        """Make room for size bytes after the data of the buffer."""
+        if self._end + size <= len(self._data):
+            return
+        incomplete = self._end - self._start
+        if incomplete + size > len(self._data):
+            data = bytearray(max(2 * len(self._data), incomplete + size))
+            data[:incomplete] = self._view[self._start:self._end]
+            self._data, self._view = data, memoryview(data)
+        else:  # Move the incomplete frame to the front
+            self._data[:incomplete] = self._data[self._start:self._end]
+        self._start, self._end = 0, incomplete
+
+    def _commit(self, size):
+        """Split the complete frames of the size bytes added to the buffer."""
+        begin, self._end = self._end, self._end + size
+        last = self._data.rfind(b'\n', begin, self._end)
+        if last >= 0:
+            frames = bytes(self._view[self._start:last]).split(b'\n')
+            # Messages can be separated by more than one new line
+            self._frames.extend(frame for frame in frames if frame.strip())
+            self._start = last + 1
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end - self._start > self.max_frame_size:
+            logging.debug('Discard %d bytes without message end',
+                          self._end - self._start)
+            self.errors += 1
+            self._start = self._end = 0
+
+    def feed(self, data):
+        """Add received data of the stream."""
+        start = time.perf_counter_ns() if self.profiler is not None else 0
+        self._reserve(len(data))
+        self._data[self._end:self._end + len(data)] = data
+        self._commit(len(data))
+        if self.profiler is not None:
+            self.profiler.record(profiling.FRAME,
+                                 time.perf_counter_ns() - start)
+
+    def receive(self, client_socket):
+        """Receive data of the socket into the buffer.
+
+        :returns: Memoryview of the received data, it is only valid until
+        the next call. Empty if the connection is closed.
+        """
+        self._reserve(self.MIN_FREE)
+        begin = self._end
+        if self.profiler is None:
+            size = client_socket.recv_into(self._view[begin:])
+            self._commit(size)
+        else:
+            start = time.perf_counter_ns()
+            timeout = client_socket.gettimeout()
+            if timeout != 0:  # Waiting for data is no reading
+                ready = _wait_readable(client_socket, timeout)
+                waited = time.perf_counter_ns()
+                self.profiler.record(profiling.WAIT, waited - start)
+                if not ready:
+                    raise socket.timeout('timed out')
+                start = waited
+            size = client_socket.recv_into(self._view[begin:])
+            received = time.perf_counter_ns()
+            self._commit(size)
+            self.profiler.record(profiling.READ, received - start)
+            self.profiler.record(profiling.FRAME,
+                                 time.perf_counter_ns() - received)
+        return self._view[begin:begin + size]
+
+    def __len__(self):
+        """Number of complete frames not yet consumed."""
+        return len(self._frames)
+
+    def frames(self):
+        """Yield and consume the complete raw frames."""
+        while self._frames:
+            yield self._frames.popleft()
+
+    def messages(self, prefilter=None):
+        """Yield and consume the complete frames as decoded JSON objects.
+
+        Frames that are no JSON objects are dropped.
+
+        :param prefilter: Function called with each raw frame, frames it
+        returns False for are skipped without decoding them
+        """
+        for frame in self.frames():
+            if self.skip_heartbeats and frame == b'BEAT':
+                continue
+            if prefilter is not None and not prefilter(frame):
+                self.skipped += 1
+                continue
+            try:
+                message = codec.loads(frame)
+            except ValueError:
+                message = None
+            if isinstance(message, dict):
+                yield message
+            else:
+                logging.debug('Cannot decode frame %s', frame)
+                self.errors += 1
+
+
+class _Acknowledge(futures.Future):
+
+    """Future of a send action resolved by the status reply of the daemon.
+
+    The result is True if the pilight-daemon acknowledged the action.
+    The replies are read by the sender reader thread of the client, thus
+    the future is resolved without anybody waiting for it.
+    :param timeout: Seconds until the reply is lost, None waits forever
+    """
+
+    expects = 'status'  # Reply resolving the future
+
+    def __init__(self, timeout=None):
+        futures.Future.__init__(self)
+        self.created = time.perf_counter_ns()  # For the round trip time
+        self.deadline = None if timeout is None else \
+            self.created + int(timeout * 1e9)
+
+    def claim(self):
+        """Return True if the future was pending, then only the caller
+        resolves it and it cannot be cancelled anymore.
+
+        False if it was cancelled, its waiters are notified, or it is
+        claimed already.
+        """
+        if self.running() or (self.done() and not self.cancelled()):
+            return False
+        try:
+            return self.set_running_or_notify_cancel()
+        except RuntimeError:  # Claimed by another thread meanwhile
+            return False
+
+    def resolve(self, reply):
+        self.set_result(reply['status'] == 'success')
+
+
+class _Request(_Acknowledge):
+
+    """Future of a request action resolved by the reply of the daemon.
+
+    :param expects: Message of the reply, e.g. values, or status
+    :param field: Field of the reply that is the result, None for the
+    whole reply
+    """
+
+    def __init__(self, timeout, expects, field=None):
+        _Acknowledge.__init__(self, timeout)
+        self.expects = expects
+        self.field = field
+
+    def resolve(self, reply):
+        if self.expects != 'status' and 'status' in reply:
+            self.set_exception(IOError('Request failed. Reply %s' % reply))
+        else:
+            self.set_result(reply[self.field] if self.field else reply)
+
+
+# Send queued while the connection is lost
+_Outgoing = collections.namedtuple('_Outgoing',
+                                   'message actions expires futures')
 
 
 class Client(threading.Thread):
@@ -23,7 +584,9 @@ class Client(threading.Thread):
 
     :param host: Address where the pilight-daemon intance runs
     :param port: Port of the pilight-daemon on the host
-    :param timeout: Time until a time out exception is raised when connecting
+    :param timeout: Time until a time out exception is raised when connecting.
+    A send action or request not replied in this time fails and the
+    sender connection is reset, since the order of the replies is lost.
     :param recv_ident: The identification of the receiver to sucribe
     to the pilight-daemon topics (https://manual.pilight.org/en/api)
     :param recv_codes_only: If True: only call the callback function when the
@@ -31,175 +594,885 @@ class Client(threading.Thread):
     :param veto_repeats: If True: only call the callback function when the
     pilight-daemon received a new code, not the same code repeated.
     Repeated codes happen quickly when a button is pressed.
+    :param heartbeat_interval: Seconds without received data after that the
+    connection is checked by a heartbeat. Received data proves the
+    connection, thus no heartbeats are send while data is received on it.
+    The heartbeat is send on the sender connection by its reader thread,
+    that wakes up each timeout, on the receiver connection by a receive
+    only client. None disables the
+    heartbeat.
+    :param keepalive: Seconds of idle time until TCP keepalive probes are
+    send by the operating system. None disables TCP keepalive.
+    :param dedupe_window: Seconds within an identical code is a repeat.
+    If set, veto_repeats uses a RepeatCache of dedupe_size codes instead of
+    the repeats counter of the daemon.
+    :param dedupe_size: Maximum number of codes remembered for dedupe_window
+    :param dispatcher: A pilight.dispatch.Dispatcher to call the callback
+    in worker threads or a pilight.dispatch.ProcessDispatcher to handle
+    the codes in worker processes. If None the callback is called in the
+    receiver thread.
+    :param validate_codes: Check codes with the protocol validators
+    (pilight.validators) before sending them
+    :param metrics: pilight.metrics.Metrics to update, default is a new one
+    :param recorder: pilight.record.Recorder to write the received data to
+    :param lazy: Do not connect on initialization but on the first send,
+    on start() or on connect()
+    :param connect_timeout: Time until a time out exception is raised when
+    connecting, default is timeout
+    :param outbox_size: Maximum number of sends queued while the connection
+    is lost, they are send after the reconnect. 0 disables the outbox, then
+    sends raise IOError while the connection is lost.
+    :param outbox_expiry: Seconds after that a queued send is dropped
+    :param mode: MODE_SEND opens only the sender connection, the client
+    cannot be started. MODE_RECEIVE opens only the receiver connection, the
+    client cannot send codes. MODE_BOTH opens both connections.
+    :param queue_size: Maximum number of received codes buffered for
+    codes() and get_batch(), older codes are dropped if it is full.
+    0 disables buffering.
+    :param prefilter: Drop the frames of other origins and the repeats of
+    codes by inspecting their bytes before decoding them. None does so
+    unless the JSON codec is faster (codec.NATIVE).
+    :param states: state.StateStore updated with the received messages.
+    The receiver subscribes to the device updates and requests the
+    configuration and the values of the devices when connected.
+    :param profiler: profiling.Profiler, the duration of each stage is
+    reported to it
     """
 
     # pylint: disable=too-many-arguments, too-many-instance-attributes
 
-    # How many seconds to wait before trying to reconnect
+    # How many seconds to wait before retrying to reconnect, doubled for
+    # each failed retry up to RECONNECT_MAX_WAIT_SEC
     RECONNECT_WAIT_SEC = 1
+    RECONNECT_MAX_WAIT_SEC = 60
+    # Initial size of the receive buffer in bytes
+    RECV_BUFFER_SIZE = 65536
 
     def __init__(self, host='127.0.0.1', port=5000, timeout=1,
-                 recv_ident=None, recv_codes_only=True, veto_repeats=True):
+                 recv_ident=None, recv_codes_only=True, veto_repeats=True,
+                 heartbeat_interval=1, keepalive=None, dedupe_window=None,
+                 dedupe_size=1024, dispatcher=None, validate_codes=True,
+                 metrics=None, recorder=None, lazy=False,
+                 connect_timeout=None, outbox_size=100, outbox_expiry=60,
+                 mode=MODE_BOTH, queue_size=0, prefilter=None, states=None,
+                 profiler=None):
         """Initialize the pilight client.
 
         The readout thread is not started automatically.
         """
         threading.Thread.__init__(self)
         self.daemon = True
+        if mode not in (MODE_SEND, MODE_RECEIVE, MODE_BOTH):
+            raise ValueError('Unknown client mode %s' % mode)
+        self.mode = mode
         self._stop_thread = threading.Event()
         self._lock = threading.Lock()
+        # Serializes writes to the sender connection to keep the reply order
+        self._send_lock = threading.Lock()
+        # Futures of send actions waiting for the status reply of the
+        # daemon, which answers in order. None for not acknowledged sends.
+        self._acknowledges = collections.deque()
+        # Events of heartbeats waiting for the reply of the daemon
+        self._beats = collections.deque()
+        # Time of the last data received on the receiver and on the sender
+        # connection
+        self._last_receive = self._last_reply = time.time()
+        self._reader = None  # Thread reading the replies of the sender
         self.recv_ident = recv_ident
         self.recv_codes_only = recv_codes_only
         self.veto_repeats = veto_repeats
+        self.prefilter = prefilter
+        self.states = states
+        self._repeat_cache = None
+        if dedupe_window:
+            self._repeat_cache = RepeatCache(dedupe_window, dedupe_size)
 
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.keepalive = keepalive
+        self.dispatcher = dispatcher
+        self.validate_codes = validate_codes
+        self.subscriptions = Subscriptions()
+        self.recorder = recorder
+        self.profiler = profiler
+        self._feed_decoder = MessageDecoder(profiler=profiler)
+        self.outbox_size = outbox_size
+        self.outbox_expiry = outbox_expiry
+        self._outbox = collections.deque()  # Sends queued while disconnected
+        self._outbox_lock = threading.Lock()
+        self._reconnecting = None  # Thread reconnecting in the background
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.gauge('pending_acks', lambda: len(self._acknowledges))
+        self.metrics.gauge('outbox', lambda: len(self._outbox))
+        self.buffer = CodeBuffer(queue_size) if queue_size else None
+        if self.buffer is not None:
+            self.metrics.gauge('buffered', lambda: len(self.buffer))
+            self.metrics.gauge('buffer_dropped', lambda: self.buffer.dropped)
+        if dispatcher is not None:
+            self.metrics.gauge('queue_depth', lambda: len(dispatcher))
+
+        self.callback = None
 
         # Open 2 socket connections, one for sending one for receiving data
         # That is the simplest approach to allow asynchronus communication with
         # the pilight daemon
-        self.connect_sender()
-        self.connect_receiver()
+        self.send_socket = None
+        self.receive_socket = None
+        self._connect_lock = threading.Lock()
+        self._connecting = None  # Future of the connection establishment
+        if not lazy:
+            self.connect()
 
-        # Timeout to allow receiver thread termination and to restrict blocking
-        # connection time
-        self.callback = None
+    @property
+    def state(self):
+        """Connection state: DISCONNECTED, CONNECTING or CONNECTED."""
+        connecting = self._connecting
+        if connecting is None:
+            return DISCONNECTED
+        if not connecting.done():
+            return CONNECTING
+        return DISCONNECTED if connecting.exception() else CONNECTED
+
+    def connect(self, wait=True):
+        """Open and identify the sender and the receiver connection.
+
+        Both connections are established concurrently. Nothing is done
+        if the client is connected or connecting, a failed connection is
+        retried.
+        :param wait: Wait until connected and raise IOError if the connection
+        failed. Otherwise connect in the background, see state.
+        """
+        establish = None
+        with self._connect_lock:
+            connecting = self._connecting
+            if connecting is None or (connecting.done() and
+                                      connecting.exception()):
+                connecting = establish = self._connecting = futures.Future()
+        if establish is not None:
+            if wait:
+                self._establish(establish)
+            else:
+                thread = threading.Thread(target=self._establish,
+                                          args=(establish, ),
+                                          name='pilight-connect')
+                thread.daemon = True
+                thread.start()
+        if wait:
+            connecting.result()
+
+    def _establish(self, connecting):
+        """Connect the sender in a second thread and the receiver in this
+        one and resolve the future."""
+        start = time.perf_counter_ns()
+        errors = []
+
+        def connect(function):
+            try:
+                function()
+            except (IOError, socket.error) as exception:
+                errors.append(exception)
+
+        if self.mode == MODE_SEND:
+            connect(self.connect_sender)
+        elif self.mode == MODE_RECEIVE:
+            connect(self.connect_receiver)
+        else:
+            sender = threading.Thread(target=connect,
+                                      args=(self.connect_sender, ),
+                                      name='pilight-connect-sender')
+            sender.daemon = True
+            sender.start()
+            connect(self.connect_receiver)
+            sender.join()
+        if errors:
+            self._close_socket(self.send_socket)
+            self._close_socket(self.receive_socket)
+            connecting.set_exception(errors[0])
+        else:
+            elapsed = time.perf_counter_ns() - start
+            self.metrics.observe('connect_seconds', elapsed / 1e9)
+            if self.profiler is not None:
+                self.profiler.record(profiling.CONNECT, elapsed)
+            connecting.set_result(True)
+
+    def start(self):
+        """Start the receiver thread, connect first if not connected."""
+        if self.mode == MODE_SEND:
+            raise RuntimeError('A send only client does not receive codes')
+        if self.state != CONNECTED:
+            self.connect()
+        threading.Thread.start(self)
 
     def connect_receiver(self):
         if self.recv_ident:
             client_identification_receiver = self.recv_ident
         else:
-            client_identification_receiver = {
-                "action": "identify",
-                "options": {
-                    "core": 0,  # To get CPU load and RAM of pilight daemon
-                    # To receive the RF data received by pilight
-                    "receiver": 1,
-                    "config": 0,
-                    "forward": 0
-                }
-            }
-
-        self.receive_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.receive_socket.settimeout(self.timeout)
-        self.receive_socket.connect((self.host, self.port))
+            client_identification_receiver = RECEIVER_IDENTIFICATION
+        if self.states is not None:  # Subscribe to the device updates
+            client_identification_receiver = dict(
+                client_identification_receiver,
+                options=dict(client_identification_receiver["options"],
+                             config=1))
+        if client_identification_receiver is RECEIVER_IDENTIFICATION:
+            identification = RECEIVER_IDENTIFICATION_FRAME
+        else:
+            identification = codec.encode(client_identification_receiver)
+
+        self.receive_socket = self._create_socket()
+        # Heartbeats of a receive only client are replied on this connection
+        self._receive_decoder = MessageDecoder(
+            skip_heartbeats=True, buffer_size=self.RECV_BUFFER_SIZE,
+            profiler=self.profiler)
         # Identify this clients sockets at the pilight-deamon
-        self.receive_socket.send(
-            json.dumps(client_identification_receiver).encode())
-        answer = json.loads(self.receive_socket.recv(1024).decode())
+        self.receive_socket.send(identification)
+        answer = self._read_message(self.receive_socket,
+                                    self._receive_decoder)
         # Check connections are acknowledged
-        if ('success' not in answer['status']):
+        if ('success' not in answer.get('status', '')):
             raise IOError(
                 'Connection to the pilight daemon failed. Reply %s',
                 answer)
+        if self.states is not None:  # Replies are handled by the receiver
+            self.receive_socket.sendall(REQUEST_STATES_FRAME)
+        self.receive_socket.settimeout(self.timeout)
 
     def connect_sender(self):
+        # Replies to actions of a lost connection will never arrive
+        self._fail_acknowledges(
+            IOError('Connection to the pilight daemon lost'))
+        self._beats.clear()
+
+        self.send_socket = self._create_socket()
+        # Only short replies, the round trip is profiled instead
+        self._send_decoder = MessageDecoder()
         # Identify client (https://manual.pilight.org/en/api)
-        client_identification_sender = {
-            "action": "identify",
-            "options": {
-                # To get CPU load and RAM of pilight daemon, is neverless
-                # ignored by daemon ...
-                "core": 0,
-                "receiver": 0,  # To receive the RF data received by pilight
-                "config": 0
-            }
-        }
-
-        self.send_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.send_socket.settimeout(self.timeout)
-        self.send_socket.connect((self.host, self.port))
-        self.send_socket.send(
-            json.dumps(client_identification_sender).encode())
-        answer = json.loads(self.send_socket.recv(1024).decode())
-        if ('success' not in answer['status']):
+        self.send_socket.send(SENDER_IDENTIFICATION_FRAME)
+        answer = self._read_message(self.send_socket, self._send_decoder)
+        if ('success' not in answer.get('status', '')):
             raise IOError(
                 'Connection to the pilight daemon failed. Reply %s',
                 answer)
+        self.send_socket.settimeout(self.timeout)
+        self._last_reply = time.time()
+        self._reader = threading.Thread(
+            target=self._read_replies,
+            args=(self.send_socket, self._send_decoder),
+            name='pilight-sender')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _create_socket(self):
+        """Return a socket connected to the pilight-daemon."""
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client_socket.settimeout(self.connect_timeout)
+        if self.keepalive:
+            client_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # Keepalive timing options are not available on all platforms
+            for option, value in (('TCP_KEEPIDLE', self.keepalive),
+                                  ('TCP_KEEPINTVL', self.keepalive),
+                                  ('TCP_KEEPCNT', 3)):
+                if hasattr(socket, option):
+                    client_socket.setsockopt(
+                        socket.IPPROTO_TCP, getattr(socket, option),
+                        int(max(1, value)))
+        client_socket.connect((self.host, self.port))
+        return client_socket
+
+    def _read_frame(self, client_socket, decoder):
+        """Return the next complete raw frame of the socket stream.
+
+        Frames received together with it stay in the decoder.
+        """
+        while not len(decoder):
+            data = decoder.receive(client_socket)
+            if not data:
+                raise IOError('Connection to the pilight daemon lost')
+            self.metrics.inc('bytes_received', len(data))
+        return next(decoder.frames())
+
+    def _read_message(self, client_socket, decoder):
+        """Return the next JSON object of the socket stream."""
+        while True:
+            frame = self._read_frame(client_socket, decoder)
+            try:
+                message = codec.loads(frame)
+            except ValueError:  # E.g. heartbeat
+                logging.debug('Ignore frame %s', frame)
+                continue
+            if isinstance(message, dict):
+                return message
 
-   
     def set_callback(self, function):
         """Function to be called when data is received."""
         self.callback = function
 
+    def subscribe(self, callback, protocol=None, id=None, unit=None,
+                  origin=None):
+        """Call callback for received codes of certain devices only.
+
+        The callbacks are called in addition to the callback function
+        and after the filter of the client.
+        :param protocol: Protocol name of the code, e.g. kaku_switch
+        :param id: Id of the device
+        :param unit: Unit of the device
+        :param origin: Origin of the message, e.g. receiver
+        :returns: Handle for unsubscribe()
+        """
+        # pylint: disable=redefined-builtin
+        return self.subscriptions.add(callback, protocol=protocol, id=id,
+                                      unit=unit, origin=origin)
+
+    def unsubscribe(self, handle):
+        """Remove a subscription."""
+        self.subscriptions.remove(handle)
+
     def stop(self):
         """Called to stop the reveiver thread."""
         self._stop_thread.set()
+        if self.buffer is not None:  # Wake up consumers
+            self.buffer.close()
         # f you want to close the connection in a timely fashion,
         # call shutdown() before close().
         with self._lock:  # Receive thread might use the socket
-            self.receive_socket.shutdown(socket.SHUT_RDWR)
-            self.receive_socket.close()
+            self._close_socket(self.receive_socket)
+        self._close_socket(self.send_socket)
+        reader = self._reader
+        if reader is not None and reader is not threading.current_thread():
+            reader.join()
 
-        self.send_socket.shutdown(socket.SHUT_RDWR)
-        self.send_socket.close()
+    @staticmethod
+    def _close_socket(client_socket):
+        if client_socket is None:  # Not connected
+            return
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:  # Connection already shutdown
+            pass
+        client_socket.close()
 
     def run(self):
-        # "Watchdog" thread
-        watchdog_thread = threading.Thread(target=self._watchdog, name="watchdog")
+        # "Watchdog" thread, the sender reader checks the sender connection
+        watchdog_thread = None
+        if self.heartbeat_interval and self.mode == MODE_RECEIVE:
+            watchdog_thread = threading.Thread(target=self._watchdog,
+                                               name="watchdog")
+            watchdog_thread.daemon = True
         try:
-            watchdog_thread.start()
+            if watchdog_thread:
+                watchdog_thread.start()
+            if self.dispatcher is not None:
+                self.dispatcher.start(self._handle_message)
             self._run()
         finally:
             self._stop_thread.set()
-            watchdog_thread.join()
+            if watchdog_thread:
+                watchdog_thread.join()
+            if self.dispatcher is not None:
+                self.dispatcher.stop()
         return 0
 
-    def try_sendall_with_reconnect(self, message):
+    def try_sendall_with_reconnect(self, message, actions=0,
+                                   acknowledge=True, future=None):
+        """Send data on the sender connection, reconnect in the background
+        if it is lost.
+
+        :param message: Encoded data to send
+        :param actions: Number of actions in the message the daemon replies to
+        :param acknowledge: Return futures for the replies of the actions,
+        otherwise the replies are ignored
+        :param future: Function returning the future of an action reply,
+        default are send acknowledgements
+        :returns: List of futures of the action replies
+        :raises IOError: If the connection is lost
+        """
+        def register():
+            # Register before sending, the reply can arrive at once
+            acknowledges = [(future or _Acknowledge)(self.timeout)
+                            if acknowledge else None
+                            for _ in range(actions)]
+            self._acknowledges.extend(acknowledges)
+            return acknowledges
+
+        with self._send_lock:
+            acknowledges = register()
+            try:
+                self.send_socket.sendall(message)
+            except socket.error as exception:
+                # The registered acknowledges fail on the reconnect
+                self._connection_lost(exception)
+                raise IOError('Connection to the pilight daemon lost')
+        self.metrics.inc('bytes_sent', len(message))
+        return [acknowledge for acknowledge in acknowledges if acknowledge]
+
+    def _fail_acknowledges(self, exception):
+        while self._acknowledges:
+            acknowledge = self._acknowledges.popleft()
+            if acknowledge and acknowledge.claim():
+                acknowledge.set_exception(exception)
+
+    def _read_replies(self, send_socket, decoder):
+        """Sender reader thread function, started for each sender connection.
+
+        The futures are resolved as the replies arrive, replies of not
+        acknowledged sends are consumed. The connection is checked with
+        heartbeats if no data is received, the socket timeout wakes the
+        thread up. The thread ends when the connection is lost, replaced
+        or the client is stopped.
+        """
+        beat, sent = None, 0  # Heartbeat of this thread and its send time
+        while not self._stop_thread.is_set() and \
+                self._read_reply(send_socket, decoder) and \
+                self._check_deadline(send_socket):
+            if not self.heartbeat_interval:
+                continue
+            now = time.time()
+            if beat is not None and not beat.is_set():
+                if now - sent < self.timeout:  # Wait for the reply
+                    continue
+                self._heartbeat_lost()
+                return
+            # Received data proves the connection
+            if now - self._last_reply >= self.heartbeat_interval:
+                beat, sent = self._send_heartbeat(send_socket), now
+
+    def _read_reply(self, send_socket, decoder):
+        """Read one reply of the sender connection.
+
+        A heartbeat reply resolves the oldest pending heartbeat, a status
+        reply the oldest pending action.
+        :returns: False if the connection is lost or replaced
+        """
+        try:
+            frame = self._read_frame(send_socket, decoder)
+        except socket.timeout:
+            return send_socket is self.send_socket
+        except (IOError, socket.error) as exception:
+            with self._send_lock:  # No actions of a new connection yet
+                if send_socket is not self.send_socket:  # Replaced
+                    return False
+                self._fail_acknowledges(exception)
+            # Otherwise failed to connect or closed by stop()
+            if self.state == CONNECTED and not self._stop_thread.is_set():
+                self._connection_lost(exception)
+            return False
+        # A reply proves the connection
+        self._last_reply = time.time()
+        if frame.startswith(b'BEAT'):
+            if self._beats:
+                self._beats.popleft().set()
+            return True
+        try:
+            reply = codec.loads(frame)
+        except ValueError:
+            logging.debug('Ignore frame %s', frame)
+            return True
+        if not isinstance(reply, dict):
+            return True
+        if 'status' in reply:  # Replies all actions, e.g. failed requests
+            expected = None
+        elif reply.get('message') in REQUEST_REPLIES.values():
+            expected = reply['message']
+        else:
+            return True
+        # The daemon replies in order, thus the reply is the one of the
+        # oldest action
+        acknowledge = self._acknowledges[0] if self._acknowledges else None
+        if expected is not None and \
+                getattr(acknowledge, 'expects', None) != expected:
+            logging.debug('Unexpected reply %s', reply)
+            return True
+        try:
+            self._acknowledges.popleft()
+        except IndexError:
+            logging.debug('Unexpected reply %s', reply)
+            return True
+        # Cancelled futures, e.g. of a timed out send_code, are skipped
+        if acknowledge and acknowledge.claim():
+            elapsed = time.perf_counter_ns() - acknowledge.created
+            self.metrics.observe('ack_seconds', elapsed / 1e9)
+            if self.profiler is not None:
+                self.profiler.record(profiling.ACK, elapsed)
+            if reply.get('status', 'success') != 'success':
+                self.metrics.inc('acks_failed')
+            acknowledge.resolve(reply)
+        return True
+
+    def _check_deadline(self, send_socket):
+        """Fail the pending actions if the oldest one was not replied in
+        time.
+
+        Replies are matched to the actions by their order, that cannot be
+        trusted after a lost reply, thus the connection is reset.
+        :returns: False if the connection is reset
+        """
+        try:
+            acknowledge = self._acknowledges[0]
+        except IndexError:
+            return True
+        if acknowledge is None or acknowledge.deadline is None or \
+                time.perf_counter_ns() < acknowledge.deadline:
+            return True
+        exception = IOError('No reply of the pilight daemon in time')
+        with self._send_lock:  # No actions of a new connection yet
+            if send_socket is not self.send_socket:  # Replaced
+                return False
+            self._fail_acknowledges(exception)
+        self.metrics.inc('replies_lost')
+        if self.state == CONNECTED and not self._stop_thread.is_set():
+            self._connection_lost(exception)
+        return False
+
+    def heartbeat(self):
+        """Check the connection to the pilight-daemon.
+
+        The heartbeat is serialized with send actions on the sender
+        connection, thus it can be used while codes are send.
+        :returns: True if the pilight-daemon replied in time
+        """
+        if self.state != CONNECTED:
+            return False
+        start = time.perf_counter_ns()
+        if self.mode == MODE_RECEIVE:
+            replied = self._receiver_heartbeat()
+        else:
+            replied = self._sender_heartbeat()
+        if self.profiler is not None:
+            self.profiler.record(profiling.HEARTBEAT,
+                                 time.perf_counter_ns() - start)
+        return replied
+
+    def _sender_heartbeat(self):
+        """Check the connection on the sender connection."""
+        beat = self._send_heartbeat(self.send_socket)
+        # Set by the sender reader thread
+        return beat is not None and beat.wait(self.timeout)
+
+    def _send_heartbeat(self, send_socket):
+        """Send a heartbeat on the sender connection.
+
+        :returns: Event set by the reply, None if sending failed
+        """
+        beat = threading.Event()
         try:
-            self.send_socket.sendall(message)
-        except(socket.error):
-            time.sleep(self.RECONNECT_WAIT_SEC)
-            self.connect_sender()
-            self.send_socket.send(message)
+            with self._send_lock:
+                self._beats.append(beat)
+                send_socket.sendall(b'HEART\n')
+        except socket.error:
+            return None
+        self.metrics.inc('bytes_sent', 6)
+        return beat
+
+    def _receiver_heartbeat(self):
+        """Check the connection of a receive only client.
+
+        The reply is read by the receiver thread, any data received after
+        the heartbeat proves the connection.
+        """
+        sent = time.time()
+        try:  # Sending does not interfere with the receiving thread
+            self.receive_socket.sendall(b'HEART\n')
+        except socket.error:
+            return False
+        self.metrics.inc('bytes_sent', 6)
+        deadline = sent + self.timeout
+        while self._last_receive < sent:
+            if time.time() >= deadline or self._stop_thread.wait(0.01):
+                return False
+        return True
 
     def _watchdog(self):
-        # check pilight connection every 100ms
+        """Check the receiver connection of a receive only client with
+        heartbeats if no data is received."""
         while True:
-            time.sleep(0.100)
-            self.try_sendall_with_reconnect('HEART\n'.encode())
-            answer = self.send_socket.recv(1024).decode()
-            if not (answer.startswith('BEAT')):
-                logging.debug('Heartbeat lost, reconnecting...')
-                time.sleep(self.RECONNECT_WAIT_SEC)
-                self.connect_sender()
-                self.connect_receiver()
+            # Received data proves the connection, thus wait for
+            # the heartbeat interval after the last data
+            wait = self._last_receive + self.heartbeat_interval - time.time()
+            if self._stop_thread.wait(max(wait, 0)):
+                return
+            if wait > 0 or self.heartbeat():
+                continue
+            self._heartbeat_lost()
+            self._last_receive = time.time()
+
+    def _heartbeat_lost(self):
+        """Reconnect since a heartbeat was not replied in time."""
+        if self.state == CONNECTED and not self._stop_thread.is_set():
+            # Otherwise already reconnecting
+            logging.debug('Heartbeat lost, reconnecting...')
+            self.metrics.inc('heartbeats_lost')
+            self._connection_lost(IOError('Heartbeat lost'))
+
+    def _connection_lost(self, exception):
+        """Mark the connection as lost and reconnect in the background."""
+        with self._connect_lock:
+            connecting = self._connecting
+            if connecting is not None and connecting.done() and \
+                    not connecting.exception():
+                logging.debug('Connection to the pilight daemon lost: %s',
+                              exception)
+                self._connecting = futures.Future()
+                self._connecting.set_exception(exception)
+        self._reconnect_later()
+
+    def _reconnect_later(self):
+        """Start the reconnect thread if it is not running."""
+        with self._connect_lock:
+            if self._reconnecting is not None or self._stop_thread.is_set():
+                return
+            self._reconnecting = threading.Thread(target=self._reconnect_loop,
+                                                  name='pilight-reconnect')
+            self._reconnecting.daemon = True
+            self._reconnecting.start()
+
+    def _reconnect_wait(self, attempt):
+        """Return the seconds to wait before the reconnect attempt.
+
+        The wait is doubled for each failed attempt and jittered, thus
+        many clients of a restarted daemon do not reconnect at once.
+        """
+        if not attempt:
+            return 0
+        wait = min(self.RECONNECT_MAX_WAIT_SEC,
+                   self.RECONNECT_WAIT_SEC * 2 ** (attempt - 1))
+        return wait / 2. + random.uniform(0, wait / 2.)
+
+    def _reconnect_loop(self):
+        """Reconnect until connected, then send the queued sends."""
+        attempt = 0
+        while not self._stop_thread.wait(self._reconnect_wait(attempt)):
+            attempt += 1
+            try:
+                self._reconnect()
+            except (IOError, socket.error) as exception:
+                logging.debug('Reconnect failed: %s', exception)
+                continue
+            self._flush_outbox()
+            with self._connect_lock:
+                if self.state == CONNECTED:  # Not lost again meanwhile
+                    self._reconnecting = None
+                    return
+        with self._connect_lock:
+            self._reconnecting = None
+
+    def _reconnect(self):
+        """Reconnect the sender and the receiver connection.
+
+        The receiver identifies again, thus it is subscribed to the same
+        topics of the daemon.
+        """
+        with self._send_lock:
+            with self._lock:
+                if self.state == DISCONNECTED:
+                    self.metrics.inc('reconnects')
+                    self._close_socket(self.send_socket)
+                    self._close_socket(self.receive_socket)
+                self.connect()
+
+    def _queue(self, message, actions, acknowledge):
+        """Queue a send until the connection is reestablished.
+
+        :returns: List of futures of the action replies
+        """
+        placeholders = [futures.Future() for _ in range(actions)] \
+            if acknowledge else []
+        with self._outbox_lock:
+            self._expire_outbox()
+            if len(self._outbox) >= self.outbox_size:
+                raise IOError('Not connected to the pilight daemon and the '
+                              'outbox is full')
+            self._outbox.append(_Outgoing(
+                message, actions, time.time() + self.outbox_expiry,
+                placeholders))
+        self._reconnect_later()
+        return placeholders
+
+    def _expire_outbox(self):
+        """Drop the expired sends, has to be called with the outbox lock."""
+        now = time.time()
+        while self._outbox and self._outbox[0].expires <= now:
+            for placeholder in self._outbox.popleft().futures:
+                if placeholder.set_running_or_notify_cancel():
+                    placeholder.set_exception(IOError('Send expired'))
+            self.metrics.inc('outbox_expired')
+
+    def _flush_outbox(self):
+        """Send the queued sends, their futures are resolved by the replies."""
+        while True:
+            with self._outbox_lock:
+                self._expire_outbox()
+                if not self._outbox:
+                    break
+                outgoing = self._outbox.popleft()
+            if outgoing.futures and all(placeholder.cancelled()
+                                        for placeholder in outgoing.futures):
+                continue  # Nobody waits for it anymore
+            try:
+                acknowledges = self.try_sendall_with_reconnect(
+                    outgoing.message, outgoing.actions,
+                    acknowledge=bool(outgoing.futures))
+            except IOError:  # Lost again, send after the next reconnect
+                with self._outbox_lock:
+                    self._outbox.appendleft(outgoing)
+                return
+            self.metrics.inc('codes_sent', outgoing.actions)
+            for acknowledge, placeholder in zip(acknowledges,
+                                                outgoing.futures):
+                acknowledge.add_done_callback(
+                    functools.partial(self._resolve, placeholder))
+
+    @staticmethod
+    def _resolve(placeholder, acknowledge):
+        """Pass the result of the acknowledge to the future of the queued
+        send."""
+        if not placeholder.set_running_or_notify_cancel():
+            return
+        if acknowledge.cancelled():
+            placeholder.set_exception(IOError('Send cancelled'))
+        elif acknowledge.exception() is not None:
+            placeholder.set_exception(acknowledge.exception())
+        else:
+            placeholder.set_result(acknowledge.result())
 
     def _run(self): # Thread for receiving data from pilight
         """Receiver thread function called on Client.start()."""
         logging.debug('Pilight receiver thread started')
-        if not self.callback:
+        if self.callback is None and not len(self.subscriptions) and \
+                self.buffer is None:
             raise RuntimeError('No callback function set, cancel readout thread')
 
-        def handle_messages(messages):
-            """Call callback on each receive message."""
-            for message in messages:  # Loop over received  messages
-                if message:  # Can be empty due to splitlines
-                    message_dict = json.loads(message.decode())
-                    if self.recv_codes_only:
-                        # Filter: Only use receiver messages
-                        if 'receiver' in message_dict['origin']:
-                            if self.veto_repeats:
-                                if message_dict['repeats'] == 1:
-                                    self.callback(message_dict)
-                            else:
-                                self.callback(message_dict)
-                    else:
-                        self.callback(message_dict)
-
-        while not self._stop_thread.isSet():
+        while not self._stop_thread.is_set():
             try:  # Read socket in a non blocking call and interpret data
-                # Sometimes more than one JSON object is in the stream thus
-                # split at \n
                 with self._lock:
-                    messages = self.receive_socket.recv(1024).splitlines()
-                    handle_messages(messages)
-            # FIXME handle lost connection -> reconnect
-            except (socket.timeout, ValueError):  # No data
-                pass
+                    # More than one JSON object can be in the data and
+                    # the last one can be incomplete, thus use a decoder
+                    data = self._receive_decoder.receive(self.receive_socket)
+                    if not data:
+                        raise IOError('Connection to the pilight daemon lost')
+                    # Received data proves the connection
+                    self._last_receive = time.time()
+                    self.metrics.inc('bytes_received', len(data))
+                    if self.recorder is not None:
+                        self.recorder.write(data)
+            except socket.timeout:  # No data
+                continue
+            except (IOError, socket.error) as exception:
+                if self._stop_thread.is_set():  # Closed by stop()
+                    break
+                self._connection_lost(exception)
+                # Wait for the reconnect, that also identifies the receiver
+                while self.state != CONNECTED and \
+                        not self._stop_thread.wait(0.05):
+                    pass
+                continue
+            # Do not block the socket while the messages are handled
+            self._handle_messages(self._receive_decoder)
         logging.debug('Pilight receiver thread stopped')
 
+    def feed(self, data):
+        """Pass raw data of a receive stream to the callbacks.
+
+        The data is decoded, filtered and dispatched like data received
+        from the pilight-daemon, e.g. to replay a recorded stream
+        (pilight.record). It is decoded separately from the receiver
+        connection.
+        """
+        self._feed_decoder.feed(data)
+        self._handle_messages(self._feed_decoder)
+
+    def _handle_messages(self, decoder):
+        """Call callback on each complete message of the decoder."""
+        if self.profiler is None:
+            self._dispatch_messages(decoder)
+        else:
+            with self.profiler.sampled():
+                self._dispatch_messages(decoder)
+
+    def _dispatch_messages(self, decoder):
+        """Decode, filter and dispatch the messages of the decoder."""
+        profiler = self.profiler
+        start = time.perf_counter_ns()
+        errors, skipped = decoder.errors, decoder.skipped
+        prefilter = self.prefilter
+        if prefilter is None:
+            prefilter = codec.name not in codec.NATIVE
+        if prefilter:
+            prefilter = functools.partial(
+                _prefilter, recv_codes_only=self.recv_codes_only,
+                veto_repeats=self.veto_repeats,
+                repeat_cache=self._repeat_cache)
+            if self.states is not None:  # Updates of other origins are used
+                prefilter = functools.partial(_prefilter_states, prefilter)
+        messages = list(decoder.messages(prefilter or None))
+        elapsed = time.perf_counter_ns() - start
+        self.metrics.observe('decode_seconds', elapsed / 1e9)
+        if profiler is not None:
+            profiler.record(profiling.DECODE, elapsed)
+        self.metrics.inc('messages_received', len(messages))
+        if decoder.errors != errors:
+            self.metrics.inc('decode_errors', decoder.errors - errors)
+        if decoder.skipped != skipped:
+            self.metrics.inc('messages_skipped', decoder.skipped - skipped)
+        for message_dict in messages:  # Loop over received messages
+            if profiler is not None:
+                start = time.perf_counter_ns()
+            if self.states is not None:
+                self.states.update(message_dict)
+            passed = _filter_message(message_dict, self.recv_codes_only,
+                                     self.veto_repeats, self._repeat_cache)
+            if profiler is not None:
+                profiler.record(profiling.FILTER,
+                                time.perf_counter_ns() - start)
+            if passed:
+                if self.dispatcher is not None:  # Call in worker thread
+                    self.dispatcher.submit(message_dict)
+                else:
+                    self._handle_message(message_dict)
+
+    def _handle_message(self, message_dict):
+        """Pass a received message to the buffer, the callback and the
+        subscribers."""
+        start = time.perf_counter_ns()
+        if self.buffer is not None:
+            self.buffer.put(message_dict)
+        if self.callback is not None:
+            self.callback(message_dict)
+        for callback in self.subscriptions.match(message_dict):
+            callback(message_dict)
+        elapsed = time.perf_counter_ns() - start
+        self.metrics.observe('callback_seconds', elapsed / 1e9)
+        if self.profiler is not None:
+            self.profiler.record(profiling.CALLBACK, elapsed)
+
+    def codes(self, timeout=None):
+        """Yield received codes, needs a queue_size.
+
+        :param timeout: Seconds to wait for a code, None waits forever.
+        The iteration ends on timeout and when the client is stopped.
+        """
+        if self.buffer is None:
+            raise RuntimeError('Received codes are not buffered')
+        while True:
+            codes = self.buffer.get(1, timeout)
+            if not codes:
+                return
+            yield codes[0]
+
+    def get_batch(self, max_n, max_wait=None):
+        """Return up to max_n received codes at once, needs a queue_size.
+
+        :param max_n: Maximum number of codes
+        :param max_wait: Seconds to wait for max_n codes, None waits until
+        max_n codes are received
+        :returns: List of codes, can be empty
+        """
+        if self.buffer is None:
+            raise RuntimeError('Received codes are not buffered')
+        return self.buffer.get_batch(max_n, max_wait)
+
     def send_code(self, data, acknowledge=True):
         """Send a RF code known to the pilight-daemon.
 
@@ -209,29 +1482,136 @@ class Client(threading.Thread):
         :param acknowledge: Raise IO exception if the code is not
         send by the pilight-deamon
         """
-        if "protocol" not in data:
-            raise ValueError(
-                'Pilight data to send does not contain a protocol info. '
-                'Check the pilight-send doku!', str(data))
+        if not acknowledge:
+            self._send_codes([data], acknowledge=False)
+            return
 
-        # Create message to send
-        message = {
+        acknowledge = self.send_code_nowait(data)
+        try:
+            received = acknowledge.result(self.timeout)
+        except futures.TimeoutError:
+            acknowledge.cancel()  # Do not send it if it is queued
+            received = False
+        if not received:
+            raise IOError('Send code failed. Code: %s', str(data))
+
+    def send_code_nowait(self, data):
+        """Send a RF code without waiting for the acknowledgement.
+
+        :param data: Dictionary with the data
+        :returns: Future with the result True if the code was send by
+        the pilight-daemon
+        """
+        return self._send_codes([data])[0]
+
+    def send_codes(self, codes, acknowledge=True):
+        """Send many RF codes in one go, e.g. to switch a scene.
+
+        All codes are written back to back and the acknowledgements are
+        collected afterwards, thus sending many codes takes about the time
+        of one round trip to the pilight-daemon.
+        :param codes: Iterable of dictionaries with the data
+        :param acknowledge: Wait for the acknowledgements of the codes
+        :returns: List with True for each code send by the pilight-daemon,
+        False otherwise. None if not acknowledged.
+        """
+        acknowledges = self._send_codes(list(codes), acknowledge)
+        if not acknowledge:
+            return None
+        results = []
+        for acknowledge in acknowledges:
+            try:
+                results.append(acknowledge.result(self.timeout))
+            except futures.TimeoutError:
+                acknowledge.cancel()  # Do not send it if it is queued
+                results.append(False)
+            except IOError:
+                results.append(False)
+        return results
+
+    def request(self, action, **fields):
+        """Send an action of the pilight API, e.g. control.
+
+        Many requests can be pending, each reply is matched to its request
+        by the order of the replies and their type.
+        :param action: Action, e.g. "control" or "request values"
+        :param fields: Further fields of the action, e.g. code
+        :returns: Future with the reply of the pilight-daemon, the
+        result is waited for with a timeout per request
+        """
+        return self._request(dict(fields, action=action),
+                             REQUEST_REPLIES.get(action, 'status'))
+
+    def request_values(self):
+        """Request the values of all devices.
+
+        :returns: Future with the list of device values
+        """
+        return self._request({"action": "request values"}, 'values',
+                             'values')
+
+    def request_config(self):
+        """Request the configuration of the pilight-daemon.
+
+        :returns: Future with the configuration
+        """
+        return self._request({"action": "request config"}, 'config',
+                             'config')
+
+    def _request(self, message, expects, field=None):
+        if self.mode == MODE_RECEIVE:
+            raise RuntimeError('A receive only client cannot send requests')
+        if self._connecting is None or self.state == CONNECTING:
+            self.connect()  # Wait for the connection
+        if self.state != CONNECTED:
+            self._reconnect_later()
+            raise IOError('Not connected to the pilight daemon')
+        return self.try_sendall_with_reconnect(
+            codec.encode(message), actions=1,
+            future=functools.partial(_Request, expects=expects,
+                                     field=field))[0]
+
+    def check_codes(self, codes):
+        """Raise ValueError for codes the pilight-daemon cannot send."""
+        for data in codes:
+            if "protocol" not in data:
+                raise ValueError(
+                    'Pilight data to send does not contain a protocol info. '
+                    'Check the pilight-send doku!', str(data))
+            if self.validate_codes:  # Reject invalid codes without round trip
+                validators.validate(data)
+
+    def _send_codes(self, codes, acknowledge=True):
+        if self.mode == MODE_RECEIVE:
+            raise RuntimeError('A receive only client cannot send codes')
+        if self._connecting is None:  # First use of a lazy client
+            self.connect()
+        self.check_codes(codes)
+
+        # Create message to send, the messages are new line terminated
+        start = time.perf_counter_ns()
+        message = b''.join(codec.encode({
             "action": "send",  # Tell pilight daemon to send the data
             "code": data,
-        }
+        }) for data in codes)
+        if self.profiler is not None:
+            self.profiler.record(profiling.ENCODE,
+                                 time.perf_counter_ns() - start)
 
-        # If connection is closed IOError is raised
-        self.try_sendall_with_reconnect(json.dumps(message).encode())
-        
-        if acknowledge:  # Check if command is acknowledged by pilight daemon
-            messages = self.send_socket.recv(1024).splitlines()
-            received = False
-            for message in messages:  # Loop over received messages
-                if message:  # Can be empty due to splitlines
-                    acknowledge_message = json.loads(message.decode())
-                    # Filter correct message
-                    if ('status' in acknowledge_message and
-                            acknowledge_message['status'] == 'success'):
-                        received = True
-            if not received:
-                raise IOError('Send code failed. Code: %s', str(data))
+        if self.state == CONNECTING and not self.outbox_size:
+            self.connect()  # Wait for the connection
+        if self.state == CONNECTED:
+            try:
+                acknowledges = self.try_sendall_with_reconnect(
+                    message, actions=len(codes), acknowledge=acknowledge)
+            except IOError:
+                if not self.outbox_size:
+                    raise
+            else:
+                self.metrics.inc('codes_sent', len(codes))
+                return acknowledges
+        if not self.outbox_size:
+            self._reconnect_later()
+            raise IOError('Not connected to the pilight daemon')
+        # Send after the reconnect
+        return self._queue(message, len(codes), acknowledge)
@@ -0,0 +1,199 @@
+"""This module implements a pool of connections to many pilight-daemons.
+
+All connections are served by asyncio clients on one event loop running
+in one thread, thus the number of threads does not grow with the number
+of daemons.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+
+from pilight import aio, pilight
+
+
+class ClientPool(object):
+
+    """Connections to many pilight-daemons with one I/O thread.
+
+    Codes are send to the daemon of the device, looked up in the devices
+    map. Received codes of all daemons are passed to one callback or
+    iterator together with the name of the daemon.
+
+        pool = ClientPool({'ground floor': ('192.168.0.10', 5000),
+                           'first floor': ('192.168.0.11', 5000)},
+                          devices={('kaku_switch', 1, 0): 'first floor'})
+        pool.start()
+        pool.send_code({"protocol": ["kaku_switch"], "id": 1, "unit": 0,
+                        "on": 1})
+        for daemon, code in pool.codes():
+            print(daemon, code)
+
+    :param daemons: Dictionary of daemon name to (host, port)
+    :param devices: Dictionary of device key (protocol, id, unit) to daemon
+    name. Keys with id and unit or unit set to None match all ids/units.
+    :param queue_size: Maximum number of received codes buffered for
+    codes(), older codes are dropped if it is full. 0 disables buffering.
+    :param client_kwargs: Arguments of the aio.AsyncClient of each daemon
+    """
+
+    # How many seconds to wait before trying to reconnect
+    RECONNECT_WAIT_SEC = 1
+
+    def __init__(self, daemons, devices=None, queue_size=10000,
+                 **client_kwargs):
+        self.devices = dict(devices or {})
+        self.callback = None
+        self.clients = dict(
+            (name, aio.AsyncClient(host=host, port=port, **client_kwargs))
+            for name, (host, port) in daemons.items())
+        self.dropped = 0  # Codes dropped due to a full queue
+
+        self._codes = queue.Queue(queue_size) if queue_size else None
+        self._loop = None
+        self._thread = None
+        self._tasks = []
+        self._stopping = False
+
+    def start(self):
+        """Start the I/O thread and connect to all daemons.
+
+        Unreachable daemons are connected in the background.
+        """
+        self._stopping = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='pilight-pool')
+        self._thread.daemon = True
+        self._thread.start()
+        connected = [asyncio.run_coroutine_threadsafe(
+            self._start_client(name, client), self._loop)
+            for name, client in self.clients.items()]
+        for future in connected:
+            future.result()
+
+    async def _start_client(self, name, client):
+        connected = asyncio.get_event_loop().create_future()
+        self._tasks.append(asyncio.ensure_future(
+            self._serve(name, client, connected)))
+        await connected
+
+    async def _serve(self, name, client, connected):
+        """Connect the client and pass its received codes, reconnect if
+        the connection is lost."""
+        while not self._stopping:
+            try:
+                await client.connect()
+                if not connected.done():
+                    connected.set_result(True)
+                async for message_dict in client:
+                    self._deliver(name, message_dict)
+            except (IOError, asyncio.TimeoutError) as exception:
+                logging.debug('Connection to %s lost: %s', name, exception)
+            except Exception:  # pylint: disable=broad-except
+                # Reconnect anyway, otherwise the daemon is lost for good
+                logging.exception('Serving %s failed', name)
+            if not connected.done():  # Do not block start()
+                connected.set_result(False)
+            await client.close()
+            if not self._stopping:
+                await asyncio.sleep(self.RECONNECT_WAIT_SEC)
+
+    def _deliver(self, name, message_dict):
+        if self.callback is not None:
+            try:
+                self.callback(name, message_dict)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Callback failed for message %s',
+                                  message_dict)
+        if self._codes is not None:
+            if self._codes.full():
+                self._codes.get_nowait()
+                self.dropped += 1
+            self._codes.put_nowait((name, message_dict))
+
+    def stop(self):
+        """Close all connections and stop the I/O thread."""
+        if self._loop is None:
+            return
+        self._stopping = True
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    async def _stop(self):
+        for client in self.clients.values():
+            await client.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def set_callback(self, function):
+        """Function called with (daemon name, message) on received data.
+
+        It is called in the I/O thread and thus has to return quickly.
+        """
+        self.callback = function
+
+    def codes(self, timeout=None):
+        """Yield (daemon name, message) of received codes.
+
+        :param timeout: Seconds to wait for a code, None waits forever
+        """
+        if self._codes is None:
+            raise RuntimeError('Received codes are not buffered')
+        while True:
+            try:
+                yield self._codes.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+    def route(self, data):
+        """Return the name of the daemon of the device of the code."""
+        protocol, device_id, unit = pilight.device_key(data)
+        for key in ((protocol, device_id, unit), (protocol, device_id, None),
+                    (protocol, None, None)):
+            if key in self.devices:
+                return self.devices[key]
+        raise ValueError('No pilight daemon known for code %s' % data)
+
+    def _run(self, coroutine):
+        """Run a coroutine in the I/O thread and return its result."""
+        if self._loop is None:
+            raise RuntimeError('Pool is not started')
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def send_code(self, data, daemon=None, acknowledge=True):
+        """Send a code with the daemon of the device.
+
+        :param data: Dictionary with the data
+        :param daemon: Name of the daemon, default is routing by device
+        :param acknowledge: Raise IO exception if the code is not
+        send by the pilight-deamon
+        """
+        client = self.clients[daemon or self.route(data)]
+        self._run(client.send_code(data, acknowledge))
+
+    def broadcast(self, data):
+        """Send a code with all daemons.
+
+        :returns: Dictionary of daemon name to True if the code was send
+        """
+        async def send(client):
+            try:
+                await client.send_code(data)
+            except IOError:
+                return False
+            return True
+
+        async def send_all():
+            names = list(self.clients)
+            results = await asyncio.gather(
+                *[send(self.clients[name]) for name in names])
+            return dict(zip(names, results))
+
+        return self._run(send_all())
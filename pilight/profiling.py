@@ -0,0 +1,127 @@
+"""This module implements the profiling of the stages of a client.
+
+The client reports the duration of each stage in nanoseconds
+(time.perf_counter_ns) to its profiler. The profiler sums them up per
+stage and passes them to hooks, e.g. to forward them to a tracing
+system. Optionally a fraction of the received data is handled with
+cProfile enabled, the statistics of all samples are aggregated:
+
+    profiler = profiling.Profiler(sample=0.01)
+    client = pilight.Client(profiler=profiler)
+    ...
+    print(profiler.snapshot()['decode'])
+    profiler.dump('client.prof')  # Read with pstats or snakeviz
+
+Without a profiler the client does not take any timings.
+"""
+
+import contextlib
+import cProfile
+import pstats
+import random
+import threading
+
+# Stages of the client
+WAIT = 'wait'  # Wait for data of the socket, idle time
+READ = 'read'  # Copy the received data of the socket
+FRAME = 'frame'  # Split the received data into frames
+DECODE = 'decode'  # Prefilter and decode the frames
+FILTER = 'filter'  # recv_codes_only and veto_repeats, device states
+CALLBACK = 'callback'  # Buffer, callback and subscribers of a message
+ENCODE = 'encode'  # Encode the codes to send
+ACK = 'ack'  # Round trip of a send action
+HEARTBEAT = 'heartbeat'  # Round trip of a heartbeat
+CONNECT = 'connect'  # Connect and identify
+
+STAGES = (WAIT, READ, FRAME, DECODE, FILTER, CALLBACK, ENCODE, ACK,
+          HEARTBEAT, CONNECT)
+
+
+class Profiler(object):
+
+    """Durations of the client stages and sampled cProfile statistics.
+
+    :param sample: Fraction of the received data that is handled with
+    cProfile enabled, 0 disables cProfile
+    :param hooks: Functions called with the stage and the nanoseconds
+    """
+
+    def __init__(self, sample=0, hooks=()):
+        if not 0 <= sample <= 1:
+            raise ValueError('Sample has to be a fraction between 0 and 1')
+        self.sample = sample
+        self.samples = 0  # Number of profiled samples
+        self._hooks = list(hooks)
+        self._stages = {}  # Stage: [count, total, minimum, maximum]
+        self._stats = None  # Aggregated pstats.Stats of the samples
+        self._lock = threading.Lock()
+        # Only one cProfile can be active at once
+        self._profile_lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Call hook(stage, nanoseconds) for each timing."""
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def record(self, stage, nanoseconds):
+        """Add the duration of a stage."""
+        with self._lock:
+            timing = self._stages.get(stage)
+            if timing is None:
+                self._stages[stage] = [1, nanoseconds, nanoseconds,
+                                       nanoseconds]
+            else:
+                timing[0] += 1
+                timing[1] += nanoseconds
+                if nanoseconds < timing[2]:
+                    timing[2] = nanoseconds
+                if nanoseconds > timing[3]:
+                    timing[3] = nanoseconds
+            hooks = self._hooks
+        for hook in hooks:
+            hook(stage, nanoseconds)
+
+    def snapshot(self):
+        """Return the count, the total, minimum, maximum and mean
+        nanoseconds of each stage."""
+        with self._lock:
+            return dict((stage, {'count': count, 'total_ns': total,
+                                 'min_ns': minimum, 'max_ns': maximum,
+                                 'mean_ns': total // count})
+                        for stage, (count, total, minimum, maximum)
+                        in self._stages.items())
+
+    @contextlib.contextmanager
+    def sampled(self):
+        """Profile the block with cProfile for the sampled fraction."""
+        if not self.sample or random.random() >= self.sample or \
+                not self._profile_lock.acquire(False):
+            yield
+            return
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            self._profile_lock.release()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.samples += 1
+
+    def stats(self):
+        """Return the aggregated pstats.Stats of the samples, None if
+        nothing was sampled."""
+        return self._stats
+
+    def dump(self, path):
+        """Write the aggregated statistics to a file for pstats."""
+        with self._lock:
+            if self._stats is None:
+                raise RuntimeError('Nothing was sampled')
+            self._stats.dump_stats(path)
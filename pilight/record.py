@@ -0,0 +1,123 @@
+"""This module records and replays the raw receive stream of a client.
+
+The data read from the receiver connection is appended to a log file as
+records of the receive time, the data length and the data. The log is
+read memory mapped, thus large captures are not loaded into memory.
+A capture can be replayed into the receive pipeline of a client in real
+time, accelerated or as fast as possible:
+
+    recorder = record.Recorder('capture.log')
+    client = pilight.Client(recorder=recorder)
+    ...
+    recorder.close()
+
+    record.play('capture.log', client.feed, speed=10)
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'PILIGHT-RECORD-1\n'  # File header, includes the format version
+RECORD = struct.Struct('<dI')  # Receive time in seconds, data length
+
+
+class Recorder(object):
+
+    """Append-only log of the received data.
+
+    :param path: File of the log, an existing log is continued
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0  # Number of records written
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as in_file:
+                if in_file.read(len(MAGIC)) != MAGIC:
+                    raise ValueError('%s is no pilight record file' % path)
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(MAGIC)
+
+    def write(self, data, timestamp=None):
+        """Append the received data."""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            self._file.write(RECORD.pack(timestamp, len(data)))
+            self._file.write(data)
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class Capture(object):
+
+    """Memory mapped reader of a log written by a Recorder.
+
+    :param path: File of the log
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        """Yield (receive time, data) of all records."""
+        with open(self.path, 'rb') as in_file:
+            if os.fstat(in_file.fileno()).st_size < len(MAGIC):
+                raise ValueError('%s is no pilight record file' % self.path)
+            data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if data[:len(MAGIC)] != MAGIC:
+                    raise ValueError('%s is no pilight record file' %
+                                     self.path)
+                offset, end = len(MAGIC), len(data)
+                while offset + RECORD.size <= end:
+                    timestamp, length = RECORD.unpack_from(data, offset)
+                    offset += RECORD.size
+                    if offset + length > end:  # Record was not written fully
+                        break
+                    yield timestamp, data[offset:offset + length]
+                    offset += length
+            finally:
+                data.close()
+
+
+def play(path, feed, speed=1.):
+    """Replay a capture with the timing of the recording.
+
+    :param path: File of the log written by a Recorder
+    :param feed: Function called with the data, e.g. pilight.Client.feed
+    :param speed: Factor of the replay speed, e.g. 1 is real time and 10 is
+    ten times faster. None replays as fast as possible.
+    :returns: Number of replayed records
+    """
+    records = 0
+    start = first = None
+    for timestamp, data in Capture(path):
+        if speed:
+            if first is None:
+                start, first = time.time(), timestamp
+            wait = start + (timestamp - first) / speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        feed(data)
+        records += 1
+    return records
@@ -0,0 +1,216 @@
+"""This module implements the scheduling of codes to send.
+
+Sending a RF code takes the pilight-daemon much longer than the round
+trip of the send action, thus codes send in quick succession queue up
+in the daemon. The scheduler sends the codes of a client in a sender
+thread with a limited rate. While a code waits for its turn a newer code
+of the same device replaces it (last write wins), thus rapid toggles do
+not waste airtime. Codes of a higher priority are send first, thus an
+urgent command does not wait for a large scene.
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent import futures
+
+from pilight import pilight
+
+# Priorities, codes of a lower number are send first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+
+def device(data):
+    """Return the device (protocol, id, unit) of a code to send, None if
+    the code has no id, e.g. protocols addressed by a system code."""
+    key = pilight.device_key(data)
+    return key if key[1] is not None else None
+
+
+class Scheduler(object):
+
+    """Send the codes of a client with priorities and a rate limit.
+
+        scheduler = schedule.Scheduler(client, rate=5)
+        scheduler.start()
+        scheduler.send_code(data, priority=schedule.HIGH)
+
+    :param client: pilight.Client used to send the codes
+    :param rate: Maximum number of codes send per second, None does not
+    limit the rate
+    :param burst: Number of codes that can be send at once after the
+    scheduler was idle
+    :param key: Function returning the device of a code, pending codes of
+    the same device are replaced by newer ones. Codes it returns None for
+    are not coalesced, None does not coalesce at all.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, client, rate=None, burst=1, key=device):
+        if rate is not None and rate <= 0:
+            raise ValueError('Rate has to be positive')
+        if burst < 1:
+            raise ValueError('Burst has to be at least one code')
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.key = key
+
+        # Counters
+        self.submitted = 0  # Codes accepted
+        self.coalesced = 0  # Codes replaced by a newer one
+        self.sent = 0  # Codes acknowledged by the daemon
+        self.failed = 0  # Codes not acknowledged by the daemon
+
+        # Keys of the pending codes per priority, the codes, futures and
+        # priorities are stored per key
+        self._queues = dict((priority, collections.deque())
+                            for priority in PRIORITIES)
+        self._pending = {}
+        self._number = 0  # Key of codes that are not coalesced
+        self._tokens = float(burst)  # Codes that can be send now
+        self._refilled = time.monotonic()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = True
+        client.metrics.gauge('scheduled', lambda: len(self))
+
+    def __len__(self):
+        """Number of pending codes."""
+        return len(self._pending)
+
+    def start(self):
+        """Start the sender thread."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._work, name='scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the sender thread after the pending codes are send."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, data, priority=NORMAL):
+        """Queue a code to send.
+
+        :param data: Dictionary with the data
+        :param priority: One of PRIORITIES
+        :returns: Future with the result True if the code was send by the
+        pilight-daemon. Codes replaced by a newer code of the same device
+        share its future.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown priority %s' % priority)
+        self.client.check_codes([data])  # Raise in the calling thread
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('Scheduler is not started')
+            key = self.key(data) if self.key is not None else None
+            if key is None:
+                self._number += 1
+                key = self._number
+            pending = self._pending.get(key)
+            if pending is not None:  # Last write wins
+                _, future, pending_priority = pending
+                if future.cancelled():  # Keep the place in the queue
+                    future = futures.Future()
+                else:
+                    self.coalesced += 1
+                    self.client.metrics.inc('codes_coalesced')
+                if priority < pending_priority:  # Move to the higher priority
+                    self._queues[pending_priority].remove(key)
+                    self._queues[priority].append(key)
+                else:
+                    priority = pending_priority
+            else:
+                future = futures.Future()
+                self._queues[priority].append(key)
+            self._pending[key] = (data, future, priority)
+            self.submitted += 1
+            self._condition.notify_all()
+        return future
+
+    def send_code(self, data, priority=NORMAL, acknowledge=True):
+        """Send a RF code when it is its turn.
+
+        :param data: Dictionary with the data
+        :param priority: One of PRIORITIES
+        :param acknowledge: Wait until the code is send and raise IO
+        exception if the code is not send by the pilight-deamon
+        """
+        future = self.submit(data, priority)
+        if acknowledge and not future.result():
+            raise IOError('Send code failed. Code: %s', str(data))
+
+    def _wait(self):
+        """Return the seconds until the next code can be send, lock has to
+        be acquired."""
+        if self.rate is None:
+            return 0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens +
+                           (now - self._refilled) * self.rate)
+        self._refilled = now
+        return max(0, (1 - self._tokens) / self.rate)
+
+    def _pop(self):
+        """Return the code and the future of the highest priority, lock has
+        to be acquired."""
+        for priority in PRIORITIES:
+            if self._queues[priority]:
+                data, future, _ = self._pending.pop(
+                    self._queues[priority].popleft())
+                return data, future
+        raise IndexError('No code pending')
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._pending:
+                        if self._stopped:
+                            return
+                        self._condition.wait()
+                        continue
+                    wait = self._wait()
+                    if not wait:
+                        break
+                    self._condition.wait(wait)
+                data, future = self._pop()
+                if self.rate is not None:
+                    self._tokens -= 1
+            if not future.set_running_or_notify_cancel():
+                continue  # Cancelled while pending
+            try:
+                result = self._send(data)
+            except Exception as exception:  # pylint: disable=broad-except
+                logging.debug('Cannot send code %s: %s', data, exception)
+                future.set_exception(exception)
+                result = False
+            else:
+                future.set_result(result)
+            with self._condition:
+                if result:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+
+    def _send(self, data):
+        acknowledge = self.client.send_code_nowait(data)
+        try:
+            return acknowledge.result(self.client.timeout)
+        except futures.TimeoutError:
+            acknowledge.cancel()  # Do not send it if it is queued
+            return False
@@ -0,0 +1,132 @@
+"""This module implements a cache of the device states of a pilight-daemon.
+
+The cache is fed by the messages received by a client: received codes,
+the updates of the device states, the configuration and the values of
+the devices. Thus the latest known state of a device is known locally
+without asking the pilight-daemon:
+
+    states = state.StateStore()
+    client = pilight.Client(states=states)
+    client.start()
+    ...
+    print(states.get('hallway').values, states.age('hallway'))
+
+Devices are found by the name of the configuration of the daemon or by
+their (protocol, id, unit) key, see pilight.device_key.
+"""
+
+import collections
+import threading
+import time
+
+from pilight import pilight
+
+# Latest known values of a device and the time they were received
+State = collections.namedtuple('State', 'values updated')
+
+# Fields of the messages that are no state values
+_NO_VALUES = ('id', 'unit', 'protocol', 'timestamp')
+
+
+def config_key(device):
+    """Return the (protocol, id, unit) key of a device of the configuration,
+    None if the device has no id."""
+    ids = device.get('id')
+    if not ids or not isinstance(ids[0], dict):
+        return None
+    return pilight.device_key(dict(ids[0], protocol=device.get('protocol')))
+
+
+class StateStore(object):
+
+    """Latest known state of each device.
+
+    Queries take one or two dictionary lookups and do not lock, updates
+    replace the state of a device at once.
+    """
+
+    def __init__(self):
+        self.updates = 0  # Number of updated device states
+        self._states = {}  # Device key: state
+        self._names = {}  # Device name: device key
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, device):
+        return self._key(device) in self._states
+
+    def _key(self, device):
+        return self._names.get(device, device)
+
+    def get(self, device):
+        """Return the State of the device name or key, None if unknown."""
+        return self._states.get(self._key(device))
+
+    def age(self, device, now=None):
+        """Return the seconds since the state of the device was received,
+        None if unknown."""
+        state = self.get(device)
+        if state is None:
+            return None
+        return (time.time() if now is None else now) - state.updated
+
+    def devices(self):
+        """Return the names of the known devices and the keys of devices
+        without a name."""
+        named = set(self._names.values())
+        return list(self._names) + [key for key in self._states
+                                    if key not in named]
+
+    def update(self, message_dict, now=None):
+        """Update the device states of a received message.
+
+        :returns: True if the message contains device states
+        """
+        if now is None:
+            now = time.time()
+        origin = message_dict.get('origin')
+        if origin == 'receiver' and isinstance(message_dict.get('message'),
+                                               dict):
+            self._set(pilight.device_key(message_dict),
+                      message_dict['message'], now)
+        elif origin == 'update':
+            for name in message_dict.get('devices', ()):
+                self._set(self._key(name), message_dict.get('values', {}),
+                          now)
+        elif message_dict.get('message') == 'values':
+            for values in message_dict.get('values', ()):
+                for name in values.get('devices', ()):
+                    self._set(self._key(name), values.get('values', {}), now)
+        elif message_dict.get('message') == 'config':
+            devices = message_dict.get('config', {}).get('devices', {})
+            for name, device in devices.items():
+                self._add_name(name, config_key(device))
+                self._set(self._key(name), device, now)
+        else:
+            return False
+        return True
+
+    def _add_name(self, name, key):
+        """Index the device key by the name."""
+        if key is None or self._names.get(name) == key:
+            return
+        with self._lock:
+            self._names[name] = key
+            state = self._states.pop(name, None)  # Known by name only
+            if state is not None:
+                self._merge(key, state.values, state.updated)
+
+    def _set(self, key, values, now):
+        with self._lock:
+            self._merge(key, values, now)
+            self.updates += 1
+
+    def _merge(self, key, values, now):
+        """Add the values to the state of the device, lock has to be
+        acquired."""
+        merged = dict(self._states[key].values) if key in self._states else {}
+        merged.update((field, value) for field, value in values.items()
+                      if field not in _NO_VALUES)
+        self._states[key] = State(merged, now)
@@ -1,24 +1,22 @@
 """ This is a helper class providing a pilight-daemon in python.
 
-    This daemon just simulates the behavior of the real pilight-daemon
-    and is used for testing only. Of cause only a few important
-    commands are supported.
+    This daemon simulates the behavior of the real pilight-daemon
+    and is used for testing and load generation. Of cause only a few
+    important commands are supported.
 
-    This is a very hackish synchronous daemon that is
-    not an example for good socket servers!
+    All connections are served by one thread with a selector, thus
+    hundreds of clients can be connected at the same time.
 """
 
-import datetime
 import json
+import heapq
+import queue
+import selectors
 import socket
 import threading
 import time
-import sys
 
-if sys.version[0] == '2':
-    import Queue as queue
-else:
-    import queue as queue
+from pilight import pilight
 
 # Settings for the pilight-daemon simulation
 HOST = '127.0.0.1'
@@ -34,51 +32,104 @@ FAKE_DATA = {"origin": "receiver",  # Fake data being send
                  "unit": 0,
                  "off": 1}}
 
+# Devices of the configuration of the simulated pilight-daemon
+DEVICES = {"switch": {"protocol": ["kaku_switch"],
+                      "id": [{"id": 0, "unit": 0}],
+                      "state": "off"}}
+
+# Clients that do not read are disconnected if this many bytes are pending
+MAX_PENDING = 16 * 1024 * 1024
 
-class PilightDaemon(object):
 
-    """Provide a pilight-daemon in with-statement."""
+def fake_code(number):
+    """Return the fake code of the number, all codes are the same."""
+    return FAKE_DATA.copy()
 
-    def __init__(self, host=HOST, port=PORT, send_codes=False):
+
+class PilightDaemon(object):
+
+    """Provide a pilight-daemon in with-statement.
+
+    :param port: Port to listen on, 0 selects a free port. The port is
+    available as attribute of the simulation.
+    :param send_codes: Send a repeated fake code every SEND_DELAY
+    :param code_rate: Send this many codes per second instead
+    :param repeats: Number of repeats of each code at the code rate
+    :param repeat_interval: Seconds between the repeats of a code
+    :param code: Function returning the code of the number of send codes
+    :param core_interval: Seconds between core messages, None sends none
+    :param mute: Number of actions after the identification that are not
+    replied, e.g. to test timeouts
+    """
+
+    def __init__(self, host=HOST, port=PORT, send_codes=False, code_rate=None,
+                 repeats=1, repeat_interval=0, code=fake_code,
+                 core_interval=None, mute=0):
         self.host = host
         self.port = port
         self.send_codes = send_codes
         self.pilight_daemon = PilightDeamonSim(
-            self.host, self.port, self.send_codes)
+            self.host, self.port, self.send_codes, code_rate, repeats,
+            repeat_interval, code, core_interval, mute)
 
     def __enter__(self):
         self.pilight_daemon.start()
-        time.sleep(0.1)
         return self.pilight_daemon
 
     def __exit__(self, _, value, traceback):
         self.pilight_daemon.stop()
-        time.sleep(0.1)
 
 
-class PilightDeamonSim(threading.Thread):
+class _Connection(object):
 
-    """Simulate the pilight-daemon API for testing."""
+    """State of a client connection."""
 
-    def __init__(self, host, port, send_codes):
-        self.send_codes = send_codes
+    def __init__(self, client_socket):
+        self.socket = client_socket
+        self.decoder = pilight.MessageDecoder()
+        self.options = None  # Identification options, None if not identified
+        self.pending = bytearray()  # Data not send yet
+        self.closing = False  # Close when all data is send
+
+
+class PilightDeamonSim(threading.Thread):
+
+    """Simulate the pilight-daemon API for testing.
+
+    Codes are send to all clients identified as receiver, updates of the
+    device states to all clients identified with config and core messages
+    to all clients identified with core.
+    """
+
+    def __init__(self, host, port, send_codes, code_rate=None, repeats=1,
+                 repeat_interval=0, code=fake_code, core_interval=None,
+                 mute=0):
+        if send_codes and not code_rate:  # Simulate button presses
+            code_rate, repeats, repeat_interval = 1. / SEND_DELAY, 10, 0.01
+        self.code_rate = code_rate
+        self.repeats = repeats
+        self.repeat_interval = repeat_interval
+        self.code = code
+        self.core_interval = core_interval
+        self.mute = mute
+        self.codes_sent = 0  # Number of codes send, without repeats
+        self.devices = json.loads(json.dumps(DEVICES))  # Deep copy
 
         # Setup thread
         threading.Thread.__init__(self)
         self.daemon = True
         self._stop_thread = threading.Event()
-        self._lock = threading.Lock()
         self._data = queue.Queue()
+        self._connections = {}  # Socket: connection
+        self._timers = []  # Heap of (time, number, function, arguments)
+        self._timer_number = 0
+        self._start = time.time()
 
         # Setup server socket
         self.server_socket = socket.socket(
             socket.AF_INET, socket.SOCK_STREAM)
-
-        time.sleep(0.1)
         self.server_socket.setsockopt(
             socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        time.sleep(0.1)
-        self.server_socket.settimeout(0.01)  # Unset blocking
 
         # Try to bin to address. Maybe not available yet thus
         # try up to 10 times waiting up to 10 seconds.
@@ -92,87 +143,231 @@ class PilightDeamonSim(threading.Thread):
                 time.sleep(1)
         else:  # Called when for loop not breaked
             raise RuntimeError('Cannot create socket connection')
+        self.port = self.server_socket.getsockname()[1]
+        self.server_socket.listen(socket.SOMAXCONN)
+        self.server_socket.setblocking(False)
 
-        self.server_socket.listen(2)  # Allow 2 connections
-        self.client_sockets = []
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.server_socket, selectors.EVENT_READ)
+        # Wakes up the selector on stop
+        self._wakeup, self._wakeup_sender = socket.socketpair()
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
 
-        self.last_send = datetime.datetime.now()
+    @property
+    def connections(self):
+        """Number of connected clients."""
+        return len(self._connections)
 
     def run(self):
-        """Simple infinite loop handling socket connections."""
-        with self._lock:
-            while not self._stop_thread.wait(0.01):
-                self._handle_client_connections()
-                self._handle_client_data()
-                self._send_codes()
+        """Serve the connections until stopped."""
+        self._start = time.time()
+        if self.core_interval:
+            self._call_later(self.core_interval, self._send_core)
+        while not self._stop_thread.is_set():
+            timeout = self._run_due()
+            for key, events in self._selector.select(timeout):
+                if key.fileobj is self.server_socket:
+                    self._accept()
+                elif key.fileobj is self._wakeup:
+                    self._wakeup.recv(1024)
+                else:
+                    if events & selectors.EVENT_READ:
+                        self._read(key.data)
+                    if events & selectors.EVENT_WRITE:
+                        self._flush(key.data)
 
         # Close client connections
-        for client_socket in self.client_sockets:
-            client_socket.shutdown(socket.SHUT_RDWR)
-            client_socket.close()
-
-    def _send_codes(self):
-        if self.send_codes:
-            if (((datetime.datetime.now() -
-                  self.last_send).total_seconds() > SEND_DELAY)):
-                if len(self.client_sockets) > 0:
-                    for i in range(10):  # Send data 10 times to simulate button press
-                        fake_data = FAKE_DATA.copy()
-                        fake_data['repeats'] = i + 1
-                        self.client_sockets[0].send(
-                            json.dumps(fake_data).encode())
-                        time.sleep(0.01)
-
-    def _handle_client_connections(self):
-        def _new_client(client_socket):
-            """Handle new client connection.
-
-            Fake pilight-daemon protocol by returning success on identifiy action.
-            """
-            def _acknowledge_connection(messages):
-                for message in messages:  # Loop over received messages
-                    if message:  # Can be empty due to splitlines
-                        message_dict = json.loads(message.decode())
-                        if "action" in message_dict:
-                            if message_dict["action"] == "identify":
-                                client_socket.sendall(json.dumps({'status': 'success'}).encode())
-                            else:
-                                client_socket.sendall(json.dumps({'status': 'failure'}).encode())
-                            break
-
-            client_socket.settimeout(0.01)  # Unset blocking
-            messages = client_socket.recv(1024).splitlines()
-            _acknowledge_connection(messages)
-            return client_socket
-        try:
-            self.client_sockets.append(
-                _new_client(self.server_socket.accept()[0]))
-        except socket.timeout:
-            pass
-
-    def _handle_client_data(self):
-        def _handle_message(client_socket):
-            """Called in poll loop to handle messages."""
+        for connection in list(self._connections.values()):
             try:
-                messages = client_socket.recv(1024).splitlines()
-                for message in messages:  # Loop over received messages
-                    if message:  # Can be empty due to splitlines
-                        message_dict = json.loads(message.decode())
-                        self._data.put(message_dict)
-                        if message_dict["code"]["protocol"] == "daycom":
-                            client_socket.sendall(
-                                json.dumps({'status': 'success'}).encode())
-                        else:
-                            client_socket.sendall(
-                                json.dumps({'status': 'failure'}).encode())
-            except socket.error:
+                connection.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:  # Connection already closed by the client
                 pass
-
-        for client_socket in self.client_sockets:  # Simple poll for data
+            self._close(connection)
+        self._selector.close()
+        self.server_socket.close()
+        self._wakeup.close()
+        self._wakeup_sender.close()
+
+    def _call_later(self, delay, function, *args):
+        self._timer_number += 1
+        heapq.heappush(self._timers, (time.time() + delay, self._timer_number,
+                                      function, args))
+
+    def _run_due(self):
+        """Send the due codes, run the due timers and return the seconds
+        until the next one is due."""
+        now = time.time()
+        timeout = None
+        if self.code_rate:
+            due = int((now - self._start) * self.code_rate)
+            for _ in range(due - self.codes_sent):
+                self._send_code()
+            timeout = (self._start + (self.codes_sent + 1) / self.code_rate -
+                       now)
+        while self._timers and self._timers[0][0] <= now:
+            _, _, function, args = heapq.heappop(self._timers)
+            function(*args)
+        if self._timers:
+            timer = self._timers[0][0] - now
+            timeout = timer if timeout is None else min(timeout, timer)
+        return None if timeout is None else max(timeout, 0)
+
+    def _send_code(self):
+        code = self.code(self.codes_sent)
+        self.codes_sent += 1
+        for i in range(self.repeats):
+            if self.repeat_interval:
+                self._call_later(i * self.repeat_interval, self.broadcast,
+                                 dict(code, repeats=i + 1))
+            else:
+                self.broadcast(dict(code, repeats=i + 1))
+
+    def _send_core(self):
+        self.broadcast({"origin": "core", "type": -1,
+                        "values": {"cpu": 1.5, "ram": 2.5}}, option='core')
+        self._call_later(self.core_interval, self._send_core)
+
+    def broadcast(self, message, option='receiver'):
+        """Send the message to all clients identified with the option.
+
+        Only the thread of the simulation may call it, the connections are
+        not locked.
+        """
+        data = (json.dumps(message) + '\n').encode()
+        for connection in list(self._connections.values()):
+            if connection.options and connection.options.get(option):
+                self._send(connection, data)
+
+    def _accept(self):
+        while True:
             try:
-                _handle_message(client_socket)
-            except socket.timeout:  # We poll, thus timeout for no data
-                pass
+                client_socket = self.server_socket.accept()[0]
+            except socket.error:  # No new client
+                return
+            client_socket.setblocking(False)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _Connection(client_socket)
+            self._connections[client_socket] = connection
+            self._selector.register(client_socket, selectors.EVENT_READ,
+                                    connection)
+
+    def _read(self, connection):
+        try:
+            data = connection.decoder.receive(connection.socket)
+        except BlockingIOError:
+            return
+        except socket.error:  # Client disconnected
+            data = b''
+        if not data:
+            self._close(connection)
+            return
+        for frame in connection.decoder.frames():
+            if frame == b'HEART':  # Heartbeat of the client
+                self._send(connection, b'BEAT\n')
+                continue
+            try:
+                message_dict = json.loads(frame.decode())
+            except ValueError:
+                continue
+            if isinstance(message_dict, dict):
+                self._handle_message(connection, message_dict)
+
+    def _handle_message(self, connection, message_dict):
+        """Fake the pilight-daemon protocol."""
+        def reply(message):
+            self._send(connection, (json.dumps(message) + '\n').encode())
+
+        action = message_dict.get("action")
+        if connection.options is None:  # First message has to identify
+            if action == "identify":
+                connection.options = message_dict.get("options", {})
+                reply({'status': 'success'})
+            else:
+                reply({'status': 'failure'})
+                connection.closing = True
+                self._flush(connection)
+        elif self.mute:
+            self.mute -= 1
+            self._data.put(message_dict)
+        elif action == "send":
+            self._data.put(message_dict)
+            protocol = message_dict.get("code", {}).get("protocol")
+            if protocol in ("daycom", ["daycom"]):
+                reply({'status': 'success'})
+            else:
+                reply({'status': 'failure'})
+        elif action == "control":
+            self._data.put(message_dict)
+            code = message_dict.get("code", {})
+            device = self.devices.get(code.get("device"))
+            if device is None:
+                reply({'status': 'failure'})
+                return
+            values = dict(code.get("values", {}))
+            if "state" in code:
+                values["state"] = code["state"]
+            device.update(values)
+            reply({'status': 'success'})
+            self.broadcast({"origin": "update", "type": 1,
+                            "devices": [code["device"]],
+                            "values": dict(values, timestamp=int(time.time()))},
+                           option='config')
+        elif action == "request values":
+            reply({"message": "values",
+                   "values": [{"type": 1, "devices": [name],
+                               "values": dict((key, value) for key, value
+                                              in device.items()
+                                              if key not in ("protocol", "id"))}
+                              for name, device in self.devices.items()]})
+        elif action == "request config":
+            reply({"message": "config",
+                   "config": {"devices": self.devices, "gui": {}, "rules": {},
+                              "settings": {}, "hardware": {}, "registry": {}}})
+        else:
+            reply({'status': 'failure'})
+
+    def _send(self, connection, data):
+        """Send the data, data that cannot be send at once is send when
+        the client reads."""
+        if not connection.pending:
+            try:
+                sent = connection.socket.send(data)
+            except BlockingIOError:
+                sent = 0
+            except socket.error:  # Client disconnected
+                self._close(connection)
+                return
+            data = data[sent:]
+            if not data:
+                return
+            self._selector.modify(connection.socket, selectors.EVENT_READ |
+                                  selectors.EVENT_WRITE, connection)
+        connection.pending += data
+        if len(connection.pending) > MAX_PENDING:  # Client does not read
+            self._close(connection)
+
+    def _flush(self, connection):
+        if connection.pending:
+            try:
+                sent = connection.socket.send(connection.pending)
+            except BlockingIOError:
+                return
+            except socket.error:  # Client disconnected
+                self._close(connection)
+                return
+            del connection.pending[:sent]
+        if not connection.pending:
+            if connection.closing:
+                self._close(connection)
+            elif connection.socket in self._connections:
+                self._selector.modify(connection.socket, selectors.EVENT_READ,
+                                      connection)
+
+    def _close(self, connection):
+        if self._connections.pop(connection.socket, None) is None:
+            return  # Already closed
+        self._selector.unregister(connection.socket)
+        connection.socket.close()
 
     def get_data(self):
         """Return received data."""
@@ -181,9 +376,9 @@ class PilightDeamonSim(threading.Thread):
     def stop(self):
         """Called to stop the reveiver thread."""
         self._stop_thread.set()
-        with self._lock:  # Receive thread might use the socket
-            try:
-                self.server_socket.shutdown(socket.SHUT_RDWR)
-            except socket.error:  # Connection already shutdown
-                pass
-            self.server_socket.close()
+        try:
+            self._wakeup_sender.send(b'\0')
+        except socket.error:  # Already stopped
+            pass
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,187 @@
+"""Tests the asyncio pilight client.
+
+Connects to a simulation of a pilight-daemon.
+"""
+
+import asyncio
+import unittest
+
+from mock import patch
+
+from pilight import aio, codec, pilight
+from pilight.test import pilight_daemon
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def test_client_connection(self):
+        """Test for successfull pilight daemon connection."""
+        async def connect():
+            async with aio.AsyncClient(host=pilight_daemon.HOST,
+                                       port=pilight_daemon.PORT):
+                pass
+
+        with pilight_daemon.PilightDaemon():
+            asyncio.run(connect())
+
+    def test_invalid_identification(self):
+        """Send an invalid identification and check for connection failure."""
+        async def connect():
+            client = aio.AsyncClient(host=pilight_daemon.HOST,
+                                     port=pilight_daemon.PORT,
+                                     recv_ident={"action": "invalid"})
+            await client.connect()
+
+        with pilight_daemon.PilightDaemon():
+            with self.assertRaises(IOError):
+                asyncio.run(connect())
+
+    def test_send_code(self):
+        """Test for successfull and failing code send."""
+        async def send():
+            async with aio.AsyncClient(host=pilight_daemon.HOST,
+                                       port=pilight_daemon.PORT) as client:
+                await client.send_code(data={'protocol': 'daycom'})
+                # Not acknowledged reply must not be taken for the next one
+                await client.send_code(data={'protocol': 'unknown'},
+                                       acknowledge=False)
+                await client.send_code(data={'protocol': 'daycom'})
+                with self.assertRaises(IOError):
+                    await client.send_code(data={'protocol': 'unknown'})
+                with self.assertRaises(ValueError):
+                    await client.send_code(data={'no_protocol': 'test'})
+
+        with pilight_daemon.PilightDaemon() as my_daemon:
+            asyncio.run(send())
+
+        self.assertEqual(my_daemon.get_data()['code'], {'protocol': 'daycom'})
+
+    def test_receive_code(self):
+        """Test for codes received by async iteration."""
+        async def receive():
+            async with aio.AsyncClient(host=pilight_daemon.HOST,
+                                       port=pilight_daemon.PORT,
+                                       heartbeat_interval=0.1) as client:
+                codes = []
+                async for code in client:
+                    codes.append(code)
+                    if len(codes) == 3:
+                        return codes
+
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            codes = asyncio.run(asyncio.wait_for(receive(), 5))
+
+        self.assertEqual(codes, [pilight_daemon.FAKE_DATA] * 3)
+
+    def test_prefilter(self):
+        """Test that the frames are only prefiltered if enabled."""
+        async def receive(prefilter):
+            async with aio.AsyncClient(host=pilight_daemon.HOST,
+                                       port=pilight_daemon.PORT,
+                                       prefilter=prefilter) as client:
+                return await client.receive()
+
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            for prefilter in (False, True):
+                with patch.object(pilight, '_prefilter',
+                                       wraps=pilight._prefilter) as wrapped:
+                    code = asyncio.run(asyncio.wait_for(receive(prefilter), 5))
+                self.assertEqual(code, pilight_daemon.FAKE_DATA)
+                self.assertEqual(wrapped.called, prefilter)
+
+    def test_callback(self):
+        """Test for coroutine callback called by run with filter disabled."""
+        async def receive():
+            codes = []
+            client = aio.AsyncClient(host=pilight_daemon.HOST,
+                                     port=pilight_daemon.PORT,
+                                     veto_repeats=False)
+
+            async def callback(code):
+                codes.append(code['repeats'])
+                if len(codes) == 10:
+                    await client.close()
+
+            client.set_callback(callback)
+            await client.connect()
+            await client.run()
+            return codes
+
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            codes = asyncio.run(asyncio.wait_for(receive(), 5))
+
+        self.assertEqual(codes, list(range(1, 11)))
+
+    def test_malformed_replies(self):
+        """Test that too long and not object messages are skipped."""
+        async def handle(reader, writer):
+            identification = await reader.readline()
+            writer.write(b'{"status": "success"}\n')
+            if codec.loads(identification)['options'].get('receiver'):
+                writer.write(b'{"origin": "receiver", "long": "' +
+                             b'x' * 1000 + b'"}\n[1]\n' +
+                             codec.encode(pilight_daemon.FAKE_DATA))
+            else:
+                await reader.readline()
+                writer.write(b'[]\n{"status": "success"}\n')
+            await writer.drain()
+            await reader.read()  # Until the client closes
+
+        async def receive():
+            server = await asyncio.start_server(handle, pilight_daemon.HOST, 0)
+            port = server.sockets[0].getsockname()[1]
+            client = aio.AsyncClient(host=pilight_daemon.HOST, port=port,
+                                     heartbeat_interval=None)
+            client.LINE_LIMIT = 100
+            try:
+                await client.connect()
+                await client.send_code(data={'protocol': 'daycom'})
+                return await client.receive()
+            finally:
+                await client.close()
+                server.close()
+
+        code = asyncio.run(asyncio.wait_for(receive(), 5))
+        self.assertEqual(code, pilight_daemon.FAKE_DATA)
+
+    def test_many_clients(self):
+        """Test many clients receiving from one daemon on a free port."""
+        async def receive(port):
+            clients = [aio.AsyncClient(host=pilight_daemon.HOST, port=port)
+                       for _ in range(100)]
+            await asyncio.gather(*[client.connect() for client in clients])
+            codes = await asyncio.gather(*[client.receive() for client in clients])
+            await asyncio.gather(*[client.close() for client in clients])
+            return codes
+
+        with pilight_daemon.PilightDaemon(port=0, code_rate=20) as my_daemon:
+            self.assertNotEqual(my_daemon.port, 0)
+            codes = asyncio.run(asyncio.wait_for(receive(my_daemon.port), 10))
+
+        self.assertEqual(codes, [pilight_daemon.FAKE_DATA] * 100)
+
+    def test_threaded_client_codes(self):
+        """Test async iteration of codes received by a threaded client."""
+        async def receive(pilight_client):
+            codes = []
+            async for code in aio.codes(pilight_client, timeout=2):
+                codes.append(code)
+                if len(codes) == 3:
+                    pilight_client.stop()
+            return codes
+
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST,
+                                            port=pilight_daemon.PORT,
+                                            queue_size=100)
+            pilight_client.start()
+            codes = asyncio.run(asyncio.wait_for(receive(pilight_client), 5))
+
+        self.assertEqual(codes, [pilight_daemon.FAKE_DATA] * 3)
+
+    def test_no_callback(self):
+        """Test for no callback defined."""
+        with self.assertRaises(RuntimeError):
+            asyncio.run(aio.AsyncClient().run())
@@ -3,16 +3,15 @@
 Connects to a simulation of a pilight-daemon.
 """
 
+import json
+import socket
+import threading
 import unittest
 import time
+from concurrent import futures
 from mock import patch, call
 
-try:
-    from StringIO import StringIO  # Python 2
-except ImportError:
-    from io import StringIO  # Python 3
-
-from pilight import pilight
+from pilight import pilight, profiling
 from pilight.test import pilight_daemon
 
 
@@ -36,6 +35,141 @@ class TestClient(unittest.TestCase):
             with self.assertRaises(IOError):
                 pilight.Client(host='8.8.8.8', port=0)
 
+    def test_lazy_connection(self):
+        """Test connecting on first use and in the background."""
+        pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                        lazy=True)
+        self.assertEqual(pilight_client.state, pilight.DISCONNECTED)
+        self.assertFalse(pilight_client.heartbeat())
+        with self.assertRaises(IOError):  # No daemon
+            pilight_client.send_code(data={'protocol': 'daycom'})
+        self.assertEqual(pilight_client.state, pilight.DISCONNECTED)
+
+        with pilight_daemon.PilightDaemon() as my_daemon:
+            pilight_client.send_code(data={'protocol': 'daycom'})
+            self.assertEqual(pilight_client.state, pilight.CONNECTED)
+
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            lazy=True)
+            pilight_client.connect(wait=False)
+            self.assertIn(pilight_client.state, (pilight.CONNECTING, pilight.CONNECTED))
+            pilight_client.connect()
+            self.assertEqual(pilight_client.state, pilight.CONNECTED)
+        self.assertEqual(my_daemon.get_data()['code'], {'protocol': 'daycom'})
+
+    def test_connect_timeout(self):
+        """Test the connect timeout for a daemon that does not reply."""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.bind((pilight_daemon.HOST, 0))
+        server_socket.listen(2)  # Connections are never accepted
+        pilight_client = pilight.Client(host=pilight_daemon.HOST,
+                                        port=server_socket.getsockname()[1],
+                                        lazy=True, connect_timeout=0.2)
+        pilight_client.connect(wait=False)
+        self.assertEqual(pilight_client.state, pilight.CONNECTING)
+        start = time.time()
+        with self.assertRaises(IOError):
+            pilight_client.connect()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(pilight_client.state, pilight.DISCONNECTED)
+        server_socket.close()
+
+    @patch('pilight.test.test_client._callback')
+    def test_reconnect(self, mock):
+        """Test sends queued while the daemon restarts and the receiver
+        subscribed again."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            pilight_client.set_callback(_callback)
+            pilight_client.start()
+            time.sleep(0.1)
+        time.sleep(0.3)
+        self.assertNotEqual(pilight_client.state, pilight.CONNECTED)
+        start = time.time()
+        acknowledge = pilight_client.send_code_nowait(data={'protocol': 'daycom'})
+        self.assertLess(time.time() - start, 0.1)  # Does not block
+        self.assertFalse(acknowledge.done())
+
+        with pilight_daemon.PilightDaemon(send_codes=True) as my_daemon:
+            self.assertTrue(acknowledge.result(timeout=5))
+            self.assertEqual(pilight_client.state, pilight.CONNECTED)
+            time.sleep(0.5)
+        pilight_client.stop()
+
+        self.assertEqual(my_daemon.get_data()['code'], {'protocol': 'daycom'})
+        mock.assert_called_with(pilight_daemon.FAKE_DATA)
+        self.assertGreaterEqual(
+            pilight_client.metrics.snapshot()['counters']['reconnects'], 1)
+
+    def test_outbox(self):
+        """Test the outbox limits while the daemon is not reachable."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            outbox_size=1, outbox_expiry=0.2)
+            pilight_client.RECONNECT_WAIT_SEC = 10  # Only one reconnect attempt
+            pilight_client.set_callback(_callback)
+            pilight_client.start()
+        time.sleep(0.3)
+        expired = pilight_client.send_code_nowait(data={'protocol': 'daycom'})
+        with self.assertRaises(IOError):  # Outbox is full
+            pilight_client.send_code(data={'protocol': 'daycom'}, acknowledge=False)
+        time.sleep(0.3)
+        pilight_client.send_code(data={'protocol': 'daycom'}, acknowledge=False)
+        with self.assertRaises(IOError):
+            expired.result(timeout=0)
+
+        pilight_client.outbox_size = 0
+        with self.assertRaises(IOError):
+            pilight_client.send_code(data={'protocol': 'daycom'})
+        pilight_client.stop()
+
+    def test_reconnect_wait(self):
+        """Test the exponential backoff of reconnects."""
+        pilight_client = pilight.Client(lazy=True)
+        self.assertEqual(pilight_client._reconnect_wait(0), 0)  # pylint: disable=protected-access
+        for attempt, wait in ((1, 1), (3, 4), (20, pilight_client.RECONNECT_MAX_WAIT_SEC)):
+            self.assertGreaterEqual(pilight_client._reconnect_wait(attempt), wait / 2.)  # pylint: disable=protected-access
+            self.assertLessEqual(pilight_client._reconnect_wait(attempt), wait)  # pylint: disable=protected-access
+
+    @patch('pilight.test.test_client._callback')
+    def test_modes(self, mock):
+        """Test clients with only the sender or the receiver connection."""
+        # Own port, clients of other tests reconnect to the default port
+        with pilight_daemon.PilightDaemon(port=0) as my_daemon:
+            threads = threading.active_count()
+            sender = pilight.Client(host=pilight_daemon.HOST, port=my_daemon.port,
+                                    mode=pilight.MODE_SEND, heartbeat_interval=0.1)
+            sent = sender.metrics.snapshot()['counters'].get('bytes_sent', 0)
+            time.sleep(1.5)  # Heartbeats are send by the reader, it wakes up each second
+            self.assertEqual(my_daemon.connections, 1)
+            self.assertEqual(threading.active_count(), threads + 1)  # Reader only
+            self.assertGreater(sender.metrics.snapshot()['counters']['bytes_sent'], sent)
+            self.assertEqual(sender.metrics.snapshot()['counters'].get('heartbeats_lost', 0), 0)
+            sender.send_code(data={'protocol': 'daycom'})
+            self.assertTrue(sender.heartbeat())
+            with self.assertRaises(RuntimeError):
+                sender.start()
+            sender.stop()
+
+            threads = threading.active_count()
+            receiver = pilight.Client(host=pilight_daemon.HOST, port=my_daemon.port,
+                                      mode=pilight.MODE_RECEIVE, heartbeat_interval=0.1)
+            receiver.set_callback(_callback)
+            receiver.start()
+            time.sleep(0.5)  # Heartbeats are send, no codes
+            self.assertEqual(my_daemon.connections, 1)
+            self.assertEqual(threading.active_count(), threads + 2)  # Receiver and watchdog
+            self.assertTrue(receiver.heartbeat())
+            with self.assertRaises(RuntimeError):
+                receiver.send_code(data={'protocol': 'daycom'})
+            receiver.stop()
+
+        self.assertEqual(receiver.metrics.snapshot()['counters'].get('heartbeats_lost', 0), 0)
+        self.assertEqual(receiver.metrics.snapshot()['counters'].get('decode_errors', 0), 0)
+        self.assertFalse(mock.called)
+        with self.assertRaises(ValueError):
+            pilight.Client(mode='unknown')
+
     def test_send_code(self):
         """Test for successfull code send."""
         with pilight_daemon.PilightDaemon() as my_daemon:
@@ -58,6 +192,151 @@ class TestClient(unittest.TestCase):
             with self.assertRaises(ValueError):
                 pilight_client.send_code(data={'no_protocol': 'test'})
 
+    def test_send_codes(self):
+        """Test for pipelined code send with acknowledgement per code."""
+        with pilight_daemon.PilightDaemon() as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            # Not acknowledged reply must not be taken for the next ones
+            pilight_client.send_code(data={'protocol': 'unknown'}, acknowledge=False)
+            results = pilight_client.send_codes([{'protocol': 'daycom'},
+                                                 {'protocol': 'unknown'},
+                                                 {'protocol': 'daycom'}])
+            self.assertEqual(results, [True, False, True])
+
+            # Codes are not send if one of them has no protocol info
+            with self.assertRaises(ValueError):
+                pilight_client.send_codes([{'protocol': 'daycom'}, {'no_protocol': 'test'}])
+
+        self.assertEqual(my_daemon.get_data()['code'], {'protocol': 'unknown'})
+
+    def test_send_code_nowait(self):
+        """Test for acknowledgement futures of sent codes."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            success = pilight_client.send_code_nowait(data={'protocol': 'daycom'})
+            failure = pilight_client.send_code_nowait(data={'protocol': 'unknown'})
+            # Waiting for the second reply resolves the first one as well
+            self.assertFalse(failure.result(timeout=1))
+            self.assertTrue(success.done())
+            self.assertTrue(success.result())
+
+    def test_requests(self):
+        """Test that replies of many pending requests are matched."""
+        with pilight_daemon.PilightDaemon() as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            cancelled = pilight_client.request_config()
+            cancelled.cancel()
+            values = pilight_client.request_values()
+            send = pilight_client.send_code_nowait(data={'protocol': 'daycom'})
+            config = pilight_client.request_config()
+            control = pilight_client.request('control', code={'device': 'switch', 'state': 'on'})
+            unknown = pilight_client.request('control', code={'device': 'unknown'})
+            self.assertEqual(control.result(timeout=1), {'status': 'success'})
+            self.assertTrue(send.result(timeout=0))
+            self.assertEqual(config.result(timeout=0)['devices'], pilight_daemon.DEVICES)
+            self.assertEqual(values.result(timeout=0),
+                             [{'type': 1, 'devices': ['switch'], 'values': {'state': 'off'}}])
+            self.assertEqual(unknown.result(timeout=1), {'status': 'failure'})
+            self.assertEqual(my_daemon.devices['switch']['state'], 'on')
+            failed = pilight_client.request('request unknown')
+            self.assertEqual(failed.result(timeout=1), {'status': 'failure'})
+            pilight_client.stop()
+
+        pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                        lazy=True, mode=pilight.MODE_RECEIVE)
+        with self.assertRaises(RuntimeError):
+            pilight_client.request_values()
+
+    def test_request_timeout(self):
+        """Test that a request without reply fails on its deadline and resets
+        the connection, thus the next request gets its own reply."""
+        with pilight_daemon.PilightDaemon(port=0, mute=1) as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=my_daemon.port,
+                                            timeout=0.5, mode=pilight.MODE_SEND)
+            lost = pilight_client.request_values()
+            start = time.time()
+            with self.assertRaises(futures.TimeoutError):  # Waiting is not the deadline
+                lost.result(timeout=0.1)
+            self.assertLess(time.time() - start, 0.3)
+            self.assertIsInstance(lost.exception(timeout=2), IOError)
+            self.assertEqual(my_daemon.get_data(), {"action": "request values"})
+
+            while pilight_client.state != pilight.CONNECTED or \
+                    not pilight_client.metrics.snapshot()['counters'].get('reconnects'):
+                time.sleep(0.05)
+            config = pilight_client.request_config()
+            values = pilight_client.request_values()
+            self.assertEqual(config.result(timeout=1)['devices'], pilight_daemon.DEVICES)
+            self.assertEqual(values.result(timeout=1)[0]['devices'], ['switch'])
+            pilight_client.stop()
+        counters = pilight_client.metrics.snapshot()['counters']
+        self.assertEqual((counters['replies_lost'], counters['reconnects']), (1, 1))
+
+    def test_cancel_on_reply(self):
+        """Test that a future cancelled as its reply arrives does not stop
+        the reader."""
+        pending, cancelled = [], []
+        appended = threading.Event()
+
+        def cancel(stage, _):
+            if stage == profiling.ACK and not cancelled:  # Reply is resolved
+                appended.wait(1)
+                cancelled.append(pending[0].cancel())
+
+        with pilight_daemon.PilightDaemon(port=0) as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=my_daemon.port,
+                                            mode=pilight.MODE_SEND,
+                                            profiler=profiling.Profiler(hooks=[cancel]))
+            pending.append(pilight_client.send_code_nowait(data={'protocol': 'daycom'}))
+            appended.set()
+            self.assertTrue(pending[0].result(timeout=1))
+            self.assertEqual(cancelled, [False])  # Too late
+            pilight_client.send_code(data={'protocol': 'daycom'})
+            self.assertTrue(pilight_client.heartbeat())
+            pilight_client.stop()
+
+    def test_replies_read(self):
+        """Test that replies are read without waiting for the futures."""
+        with pilight_daemon.PilightDaemon(port=0) as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=my_daemon.port,
+                                            mode=pilight.MODE_SEND)
+            for _ in range(500):
+                pilight_client.send_code(data={'protocol': 'daycom'}, acknowledge=False)
+            acknowledged = threading.Event()
+            acknowledge = pilight_client.send_code_nowait(data={'protocol': 'daycom'})
+            acknowledge.add_done_callback(lambda _: acknowledged.set())
+            done, _ = futures.wait([acknowledge], timeout=2)
+            self.assertEqual(done, set([acknowledge]))
+            self.assertTrue(acknowledged.is_set())
+            self.assertEqual(pilight_client.metrics.snapshot()['gauges']['pending_acks'], 0)
+        time.sleep(0.2)  # The reader notices the closed connection
+        self.assertNotEqual(pilight_client.state, pilight.CONNECTED)
+        pilight_client.stop()
+
+    def test_heartbeat(self):
+        """Test heartbeats serialized with pending acknowledgements."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            keepalive=10)
+            acknowledge = pilight_client.send_code_nowait(data={'protocol': 'daycom'})
+            self.assertTrue(pilight_client.heartbeat())
+            self.assertTrue(acknowledge.result(timeout=1))
+            self.assertTrue(pilight_client.heartbeat())
+        self.assertFalse(pilight_client.heartbeat())
+
+    @patch('pilight.pilight.Client.heartbeat')
+    def test_heartbeat_idle_only(self, mock):
+        """Test that no heartbeats are send while data is received on the
+        checked connection, the receiver of a receive only client."""
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            heartbeat_interval=0.5, mode=pilight.MODE_RECEIVE)
+            pilight_client.set_callback(_callback)
+            pilight_client.start()
+            time.sleep(1)
+            pilight_client.stop()
+        self.assertFalse(mock.called)
+
     def test_api(self):
         """Tests connection with different receiver filter and identification."""
         recv_ident = {
@@ -108,6 +387,198 @@ class TestClient(unittest.TestCase):
 
         mock.assert_has_calls(calls)
 
+    def test_message_decoder(self):
+        """Test decoding of messages split and merged in arbitrary chunks."""
+        decoder = pilight.MessageDecoder()
+        decoder.feed(b'{"status": "succ')
+        self.assertEqual(list(decoder.messages()), [])
+        decoder.feed(b'ess"}\n\n{"repeats": 1}\nBEAT\n{"repeats"')
+        self.assertEqual(list(decoder.messages()),
+                         [{'status': 'success'}, {'repeats': 1}])
+        self.assertEqual(decoder.errors, 1)  # BEAT is no JSON object
+        decoder.feed(b': 2}\n')
+        self.assertEqual(list(decoder.frames()), [b'{"repeats": 2}'])
+
+    def test_message_decoder_receive(self):
+        """Test receiving into the reused buffer of the decoder."""
+        decoder = pilight.MessageDecoder(buffer_size=16)
+        sender, receiver = socket.socketpair()
+        try:
+            frame = b'{"repeats": 1, "message": {"id": 12345678}}'
+            sender.sendall(frame[:20])
+            self.assertEqual(bytes(decoder.receive(receiver)), frame[:20])
+            self.assertEqual(len(decoder), 0)
+            sender.sendall(frame[20:] + b'\n' + frame + b'\n' + frame[:10])
+            while len(decoder) < 2:  # Buffer grows for the frame
+                decoder.receive(receiver)
+            self.assertEqual(list(decoder.frames()), [frame, frame])
+            sender.sendall(frame[10:] + b'\n')  # Incomplete frame is kept
+            while not len(decoder):
+                decoder.receive(receiver)
+            self.assertEqual(list(decoder.frames()), [frame])
+            sender.close()
+            self.assertEqual(len(decoder.receive(receiver)), 0)
+        finally:
+            receiver.close()
+
+    def test_message_decoder_overflow(self):
+        """Test that unterminated streams are discarded."""
+        decoder = pilight.MessageDecoder(max_frame_size=10)
+        decoder.feed(b'{"status": "success"')
+        decoder.feed(b'}\n{"repeats": 1}\n')
+        self.assertEqual(list(decoder.messages()), [{'repeats': 1}])
+
+    def test_prefilter(self):
+        """Test that the prefilter drops only frames the filter drops."""
+        frames = [b'{"origin": "core", "values": {"cpu": 1.5}}',
+                  b'{"origin": "receiver", "repeats": 1, "message": {"id": 0}}',
+                  b'{"origin":"receiver","repeats":2,"message":{"id":0}}',
+                  b'{"origin": "receiver", "message": {"id": 0}}',
+                  b'{"origin": "receiver", "repeats": 1, "message": {"repeats": 3}}',
+                  b'{"origin": "receiver", "repeats": 1.0}',
+                  b'{"origin": "\\u0072eceiver", "repeats": 1}',
+                  b'{"origin": "receiver", "repeats": "1"}']
+        for recv_codes_only in (True, False):
+            for veto_repeats in (True, False):
+                for dedupe in (False, True):
+                    for frame in frames:
+                        repeat_cache = pilight.RepeatCache() if dedupe else None
+                        if pilight._filter_message(json.loads(frame.decode()), recv_codes_only,
+                                                   veto_repeats, repeat_cache):
+                            self.assertTrue(pilight._prefilter(frame, recv_codes_only,
+                                                               veto_repeats, repeat_cache))
+        self.assertFalse(pilight._prefilter(frames[0], True, False))
+        self.assertFalse(pilight._prefilter(frames[2], True, True))
+        self.assertFalse(pilight._prefilter(frames[3], True, True))
+
+        decoder = pilight.MessageDecoder()
+        decoder.feed(b'\n'.join(frames[:3]) + b'\n')
+        self.assertEqual(len(list(decoder.messages(lambda frame: b'core' not in frame))), 2)
+        self.assertEqual(decoder.skipped, 1)
+
+        received = []
+        pilight_client = pilight.Client(lazy=True, prefilter=True)
+        pilight_client.set_callback(received.append)
+        pilight_client.feed(b'\n'.join(frames) + b'\n')
+        self.assertEqual(len(received), 4)
+        self.assertEqual(pilight_client.metrics.snapshot()['counters']['messages_skipped'], 4)
+
+    def test_device_key(self):
+        """Test device keys of received codes and codes to send."""
+        self.assertEqual(pilight.device_key(pilight_daemon.FAKE_DATA), ('kaku_switch', 0, 0))
+        self.assertEqual(pilight.device_key({"origin": "receiver", "protocol": "arctech_switch",
+                                             "message": {"id": 3, "unit": 1, "state": "on"}}),
+                         ('arctech_switch', 3, 1))
+        self.assertEqual(pilight.device_key({"protocol": ["kaku_switch"], "id": 1, "unit": 0, "on": 1}),
+                         ('kaku_switch', 1, 0))
+
+    def test_repeat_cache(self):
+        """Test repeat detection within the time window."""
+        cache = pilight.RepeatCache(window=1, maxsize=2)
+        code = pilight_daemon.FAKE_DATA.copy()
+        self.assertFalse(cache.is_repeat(code, now=0))
+        # Repeats counter and other receivers do not matter
+        code['repeats'] = 3
+        self.assertTrue(cache.is_repeat(dict(code, origin='receiver2'), now=0.5))
+        # Every repeat restarts the window
+        self.assertTrue(cache.is_repeat(code, now=1.4))
+        self.assertFalse(cache.is_repeat(code, now=2.5))
+        # Least recently seen codes are evicted
+        other = dict(code, message={'id': 1})
+        cache.is_repeat(other, now=2.6)
+        cache.is_repeat(dict(code, message={'id': 2}), now=2.7)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(cache.is_repeat(code, now=2.8))
+
+    @patch('pilight.test.test_client._callback')
+    def test_receive_dedupe(self, mock):
+        """Test that a held button results in one callback."""
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            dedupe_window=0.5)
+            pilight_client.set_callback(_callback)
+            pilight_client.start()
+            time.sleep(1)
+        pilight_client.stop()
+
+        mock.assert_called_once_with(pilight_daemon.FAKE_DATA)
+
+    def test_subscriptions(self):
+        """Test matching of subscribed callbacks."""
+        subscriptions = pilight.Subscriptions()
+        code = {"origin": "receiver", "protocol": "kaku_switch",
+                "message": {"id": 1, "unit": 0, "state": "on"}}
+        all_codes = subscriptions.add('all')
+        subscriptions.add('protocol', protocol='kaku_switch')
+        subscriptions.add('device', protocol='kaku_switch', id=1, unit=0)
+        subscriptions.add('other device', protocol='kaku_switch', id=2, unit=0)
+        subscriptions.add('other origin', origin='sender')
+        self.assertEqual(sorted(subscriptions.match(code)), ['all', 'device', 'protocol'])
+
+        subscriptions.remove(all_codes)
+        self.assertEqual(len(subscriptions), 4)
+        self.assertEqual(sorted(subscriptions.match(code)), ['device', 'protocol'])
+        with self.assertRaises(ValueError):
+            subscriptions.remove(all_codes)
+        with self.assertRaises(ValueError):
+            subscriptions.add('unknown', state='on')
+
+    @patch('pilight.test.test_client._callback')
+    def test_subscribe(self, mock):
+        """Test for received codes passed to subscribed callbacks only."""
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            pilight_client.subscribe(_callback, protocol='kaku_switch', id=0, unit=0)
+            pilight_client.subscribe(mock.other_device, protocol='kaku_switch', id=1)
+            pilight_client.start()
+            time.sleep(1)
+        pilight_client.stop()
+
+        mock.assert_called_with(pilight_daemon.FAKE_DATA)
+        self.assertFalse(mock.other_device.called)
+
+    def test_code_buffer(self):
+        """Test the bounded buffer of received codes."""
+        buffer = pilight.CodeBuffer(maxsize=3)
+        for code in range(5):
+            buffer.put(code)
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual(buffer.get(max_n=2), [2, 3])
+        self.assertEqual(buffer.get_batch(2, max_wait=0.1), [4])
+        self.assertEqual(buffer.get(timeout=0), [])
+
+        woken = []
+        buffer.add_waiter(lambda: woken.append(True))
+        self.assertFalse(woken)
+        threading.Timer(0.1, buffer.put, (5, )).start()
+        self.assertEqual(buffer.get_batch(1), [5])
+        self.assertTrue(woken)
+        buffer.close()
+        self.assertEqual(buffer.get(), [])
+
+    def test_codes(self):
+        """Test iterating and batch draining of received codes."""
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            queue_size=100)
+            pilight_client.start()
+            codes = []
+            for code in pilight_client.codes(timeout=1):
+                codes.append(code)
+                if len(codes) == 2:
+                    break
+            self.assertEqual(codes, [pilight_daemon.FAKE_DATA] * 2)
+            self.assertEqual(pilight_client.get_batch(3, max_wait=2),
+                             [pilight_daemon.FAKE_DATA] * 3)
+            pilight_client.stop()
+        self.assertEqual(list(pilight_client.codes()), [])  # Ends when stopped
+
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            with self.assertRaises(RuntimeError):
+                pilight_client.get_batch(1)
+
     def test_invalid_identification(self):
         """Send an invalid identification and check for connection failure."""
         recv_ident = {
@@ -125,5 +596,5 @@ class TestClient(unittest.TestCase):
             pilight_client.start()
             time.sleep(1)  # Give time to set thread status
 
-        self.assertFalse(pilight_client.isAlive())
+        self.assertFalse(pilight_client.is_alive())
         pilight_client.stop()
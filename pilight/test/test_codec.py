@@ -0,0 +1,43 @@
+"""Tests the JSON codec of the pilight messages."""
+
+import unittest
+
+from pilight import codec, pilight
+
+
+class TestCodec(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def tearDown(self):
+        codec.use()  # Restore fastest codec
+
+    def test_codecs(self):
+        """Test that all available codecs use bytes."""
+        message = {'origin': 'receiver', 'message': {'id': 1, 'on': True, 'dim': 1.5}}
+        for name in codec.CODECS:
+            codec.use(name)
+            self.assertEqual(codec.name, name)
+            encoded = codec.dumps(message)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(codec.loads(encoded), message)
+            self.assertEqual(codec.loads(encoded + b'\n'), message)
+            with self.assertRaises(ValueError):
+                codec.loads(b'BEAT')
+        with self.assertRaises(ValueError):
+            codec.use('unknown')
+
+    def test_encode(self):
+        """Test the new line terminated messages and the encoded
+        identifications."""
+        for name in codec.CODECS:
+            codec.use(name)
+            encoded = codec.encode({'action': 'send', 'code': {'protocol': ['daycom'], 'id': 1}})
+            self.assertTrue(encoded.endswith(b'\n'))
+            # Values that are equal in Python but not in JSON
+            for value in (1, True, 1.0):
+                self.assertIs(type(codec.loads(codec.encode({'on': value}))['on']), type(value))
+        self.assertEqual(codec.loads(pilight.SENDER_IDENTIFICATION_FRAME),
+                         pilight.SENDER_IDENTIFICATION)
+        self.assertEqual(codec.loads(pilight.RECEIVER_IDENTIFICATION_FRAME),
+                         pilight.RECEIVER_IDENTIFICATION)
@@ -0,0 +1,167 @@
+"""Tests the dispatch of received messages to worker threads."""
+
+import os
+import threading
+import time
+import unittest
+
+from pilight import dispatch, pilight
+from pilight.test import pilight_daemon
+
+
+def _code(device_id, state='on'):
+    return {"origin": "receiver",
+            "protocol": "kaku_switch",
+            "message": {"id": device_id, "unit": 0, "state": state},
+            "repeats": 1}
+
+
+def _handle(message):
+    """Handler of the worker processes, has to be picklable."""
+    if message['message'].get('state') == 'fail':
+        raise RuntimeError('Handler failed')
+    return dict(message, pid=os.getpid())
+
+
+class TestDispatcher(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def _fill(self, policy, codes):
+        """Submit codes while the worker is blocked, return the handled ones."""
+        handled = []
+        release = threading.Event()
+        started = threading.Event()
+
+        def handler(message):
+            started.set()
+            release.wait()
+            handled.append(message)
+
+        dispatcher = dispatch.Dispatcher(maxsize=2, policy=policy)
+        dispatcher.start(handler)
+        dispatcher.submit(_code(0))  # Blocks the worker
+        started.wait(1)
+        results = [dispatcher.submit(code) for code in codes]
+        release.set()
+        dispatcher.stop()
+        return dispatcher, results, handled
+
+    def test_drop_newest(self):
+        """Test that new messages are dropped if the queue is full."""
+        dispatcher, results, handled = self._fill(
+            dispatch.DROP_NEWEST, [_code(1), _code(2), _code(3)])
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(handled, [_code(0), _code(1), _code(2)])
+        self.assertEqual(dispatcher.dropped, 1)
+
+    def test_drop_oldest(self):
+        """Test that old messages are dropped if the queue is full."""
+        dispatcher, results, handled = self._fill(
+            dispatch.DROP_OLDEST, [_code(1), _code(2), _code(3)])
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(handled, [_code(0), _code(2), _code(3)])
+        self.assertEqual(dispatcher.dropped, 1)
+
+    def test_coalesce(self):
+        """Test that queued messages of a device are replaced."""
+        dispatcher, _, handled = self._fill(
+            dispatch.COALESCE, [_code(1), _code(2), _code(1, 'off'), _code(3)])
+        self.assertEqual(handled, [_code(0), _code(2), _code(3)])
+        self.assertEqual(dispatcher.coalesced, 1)
+        self.assertEqual(dispatcher.dropped, 1)
+
+    def test_block(self):
+        """Test that submit waits for space in the queue."""
+        handled = []
+        dispatcher = dispatch.Dispatcher(maxsize=1)
+        dispatcher.start(lambda message: (time.sleep(0.05), handled.append(message)))
+        for i in range(5):
+            self.assertTrue(dispatcher.submit(_code(i)))
+        dispatcher.stop()
+        self.assertEqual(handled, [_code(i) for i in range(5)])
+        self.assertEqual(dispatcher.dropped, 0)
+
+    def test_handler_error(self):
+        """Test that exceptions of the handler do not stop the workers."""
+        handled = []
+
+        def handler(message):
+            if message['message']['id'] == 0:
+                raise RuntimeError('Handler failed')
+            handled.append(message)
+
+        dispatcher = dispatch.Dispatcher(workers=2)
+        dispatcher.start(handler)
+        dispatcher.submit(_code(0))
+        dispatcher.submit(_code(1))
+        dispatcher.stop()
+        self.assertEqual(handled, [_code(1)])
+        self.assertEqual(dispatcher.errors, 1)
+
+    def test_invalid_policy(self):
+        """Test for unknown overflow policy."""
+        with self.assertRaises(ValueError):
+            dispatch.Dispatcher(policy='unknown')
+
+    def test_client_dispatcher(self):
+        """Test that a slow callback does not stall the receiver."""
+        handled = []
+        dispatcher = dispatch.Dispatcher(maxsize=1, policy=dispatch.DROP_NEWEST)
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            veto_repeats=False, dispatcher=dispatcher)
+            pilight_client.set_callback(lambda message: (time.sleep(0.5),
+                                                         handled.append(message)))
+            pilight_client.start()
+            time.sleep(1)
+            pilight_client.stop()
+            pilight_client.join()
+
+        # Receiver kept on reading, thus codes were dropped
+        self.assertTrue(dispatcher.dropped > 0)
+        self.assertEqual(len(handled), dispatcher.submitted)
+
+    def test_process_dispatcher(self):
+        """Test that the messages of a device are handled in order."""
+        results = []
+        dispatcher = dispatch.ProcessDispatcher(_handle, processes=2, batch_size=7,
+                                                results=True)
+        # The threads of the client are not forked
+        self.assertIn(dispatcher._context.get_start_method(),  # pylint: disable=protected-access
+                      ('forkserver', 'spawn'))
+        dispatcher.start(results.append)
+        codes = [_code(device_id, state) for state in range(20) for device_id in range(4)]
+        for code in codes + [_code(0, 'fail')]:
+            self.assertTrue(dispatcher.submit(code))
+        dispatcher.stop()
+        self.assertFalse(dispatcher.submit(_code(0)))
+
+        self.assertEqual((dispatcher.submitted, dispatcher.handled, dispatcher.errors),
+                         (81, 81, 1))
+        self.assertEqual(len(dispatcher), 0)
+        self.assertEqual(len(results), 80)
+        for device_id in range(4):
+            handled = [result for result in results if result['message']['id'] == device_id]
+            self.assertEqual([result['message']['state'] for result in handled], list(range(20)))
+            self.assertEqual(len(set(result['pid'] for result in handled)), 1)
+            self.assertNotEqual(handled[0]['pid'], os.getpid())
+
+    def test_client_process_dispatcher(self):
+        """Test that the results of the processes are passed to the callback."""
+        handled = []
+        dispatcher = dispatch.ProcessDispatcher(_handle, processes=2, results=True)
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            dispatcher=dispatcher)
+            pilight_client.set_callback(handled.append)
+            pilight_client.start()
+            time.sleep(0.5)
+            pilight_client.stop()
+            pilight_client.join()
+
+        self.assertTrue(handled)
+        self.assertEqual(len(handled), dispatcher.submitted)
+        self.assertNotEqual(handled[0].pop('pid'), os.getpid())
+        self.assertEqual(handled[0], pilight_daemon.FAKE_DATA)
+
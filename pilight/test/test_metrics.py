@@ -0,0 +1,61 @@
+"""Tests the metrics of the pilight client."""
+
+import time
+import unittest
+
+from pilight import pilight
+from pilight.metrics import Metrics
+from pilight.test import pilight_daemon
+
+
+class TestMetrics(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def test_metrics(self):
+        """Test counters, gauges, histograms and the Prometheus export."""
+        metrics = Metrics(buckets=(0.1, 1))
+        metrics.inc('reconnects')
+        metrics.inc('bytes_sent', 10)
+        metrics.inc('bytes_sent', 5)
+        metrics.gauge('queue_depth', lambda: 3)
+        for value in (0.05, 0.1, 0.5, 2):
+            metrics.observe('ack_seconds', value)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'reconnects': 1, 'bytes_sent': 15})
+        self.assertEqual(snapshot['gauges'], {'queue_depth': 3})
+        self.assertEqual(snapshot['histograms']['ack_seconds'],
+                         {'buckets': [(0.1, 2), (1, 3), (float('inf'), 4)],
+                          'sum': 2.65, 'count': 4})
+
+        text = metrics.prometheus()
+        self.assertIn('# TYPE pilight_bytes_sent_total counter\n'
+                      'pilight_bytes_sent_total 15\n', text)
+        self.assertIn('pilight_queue_depth 3\n', text)
+        self.assertIn('pilight_ack_seconds_bucket{le="0.1"} 2\n'
+                      'pilight_ack_seconds_bucket{le="1"} 3\n'
+                      'pilight_ack_seconds_bucket{le="+Inf"} 4\n'
+                      'pilight_ack_seconds_sum 2.65\n'
+                      'pilight_ack_seconds_count 4\n', text)
+
+    def test_client_metrics(self):
+        """Test the metrics updated by the client."""
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            pilight_client.set_callback(lambda _: None)
+            pilight_client.send_codes([{'protocol': 'daycom'}, {'protocol': 'unknown'}])
+            pilight_client.start()
+            time.sleep(1)
+        pilight_client.stop()
+
+        snapshot = pilight_client.metrics.snapshot()
+        counters = snapshot['counters']
+        self.assertEqual(counters['codes_sent'], 2)
+        self.assertEqual(counters['acks_failed'], 1)
+        self.assertGreater(counters['bytes_sent'], 0)
+        self.assertGreater(counters['bytes_received'], 0)
+        self.assertGreater(counters['messages_received'], 0)
+        self.assertEqual(snapshot['gauges']['pending_acks'], 0)
+        self.assertEqual(snapshot['histograms']['ack_seconds']['count'], 2)
+        self.assertGreater(snapshot['histograms']['callback_seconds']['count'], 0)
@@ -0,0 +1,83 @@
+"""Tests the pool of connections to many pilight-daemons."""
+
+import threading
+import time
+import unittest
+
+from pilight import pool
+from pilight.test import pilight_daemon
+
+DAEMONS = {'first': (pilight_daemon.HOST, pilight_daemon.PORT),
+           'second': (pilight_daemon.HOST, pilight_daemon.PORT + 1)}
+
+
+class TestClientPool(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def test_send_code(self):
+        """Test routing of codes to the daemon of the device."""
+        client_pool = pool.ClientPool(DAEMONS, devices={('daycom', None, None): 'second'})
+        with pilight_daemon.PilightDaemon() as first:
+            with pilight_daemon.PilightDaemon(port=pilight_daemon.PORT + 1) as second:
+                client_pool.start()
+                client_pool.send_code({'protocol': 'daycom', 'id': 1})
+                client_pool.send_code({'protocol': 'daycom', 'id': 2}, daemon='first')
+                with self.assertRaises(ValueError):
+                    client_pool.send_code({'protocol': 'unknown'})
+                self.assertEqual(client_pool.broadcast({'protocol': 'daycom', 'id': 3}),
+                                 {'first': True, 'second': True})
+                client_pool.stop()
+
+        self.assertEqual(second.get_data()['code'], {'protocol': 'daycom', 'id': 1})
+        self.assertEqual(first.get_data()['code'], {'protocol': 'daycom', 'id': 2})
+        self.assertEqual(first.get_data()['code'], {'protocol': 'daycom', 'id': 3})
+        self.assertEqual(second.get_data()['code'], {'protocol': 'daycom', 'id': 3})
+
+    def test_receive(self):
+        """Test that codes of all daemons are received with one thread."""
+        threads = threading.active_count()
+        client_pool = pool.ClientPool(DAEMONS)
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            with pilight_daemon.PilightDaemon(port=pilight_daemon.PORT + 1, send_codes=True):
+                client_pool.start()
+                self.assertEqual(threading.active_count(), threads + 3)  # Two daemons
+                time.sleep(0.5)
+                client_pool.stop()
+
+        daemons = set()
+        for daemon, code in client_pool.codes(timeout=0):
+            self.assertEqual(code, pilight_daemon.FAKE_DATA)
+            daemons.add(daemon)
+        self.assertEqual(daemons, set(DAEMONS))
+
+    def test_reconnect_on_error(self):
+        """Test that an unexpected error of a client reconnects it."""
+        client_pool = pool.ClientPool({'first': DAEMONS['first']})
+        client = client_pool.clients['first']
+        receive = client.receive
+        failures = []
+
+        async def fail_once():
+            if not failures:
+                failures.append(True)
+                raise RuntimeError('Unexpected')
+            return await receive()
+
+        client.receive = fail_once
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            client_pool.start()
+            codes = client_pool.codes(timeout=5)
+            self.assertEqual(next(codes), ('first', pilight_daemon.FAKE_DATA))
+            client_pool.stop()
+        self.assertEqual(failures, [True])
+
+    def test_unreachable_daemon(self):
+        """Test that an unreachable daemon does not prevent the start."""
+        client_pool = pool.ClientPool(DAEMONS)
+        with pilight_daemon.PilightDaemon():
+            client_pool.start()
+            client_pool.send_code({'protocol': 'daycom'}, daemon='first')
+            with self.assertRaises(IOError):
+                client_pool.send_code({'protocol': 'daycom'}, daemon='second')
+            client_pool.stop()
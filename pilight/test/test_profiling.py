@@ -0,0 +1,105 @@
+"""Tests the profiling of the client stages."""
+
+import os
+import pstats
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from pilight import pilight, profiling
+from pilight.test import pilight_daemon
+
+
+class TestProfiling(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def test_profiler(self):
+        """Test the aggregation of the timings and the hooks."""
+        timings = []
+        profiler = profiling.Profiler(hooks=[lambda *timing: timings.append(timing)])
+        profiler.record(profiling.DECODE, 30)
+        profiler.record(profiling.DECODE, 10)
+        self.assertEqual(profiler.snapshot(),
+                         {'decode': {'count': 2, 'total_ns': 40, 'min_ns': 10,
+                                     'max_ns': 30, 'mean_ns': 20}})
+        self.assertEqual(timings, [('decode', 30), ('decode', 10)])
+        with profiler.sampled():  # Sampling disabled
+            pass
+        self.assertIsNone(profiler.stats())
+        with self.assertRaises(ValueError):
+            profiling.Profiler(sample=2)
+
+    def test_wait(self):
+        """Test that waiting for data is not timed as reading."""
+        profiler = profiling.Profiler()
+        decoder = pilight.MessageDecoder(profiler=profiler)
+        receiver, sender = socket.socketpair()
+        try:
+            receiver.settimeout(0.05)
+            with self.assertRaises(socket.timeout):
+                decoder.receive(receiver)
+            self.assertNotIn(profiling.READ, profiler.snapshot())
+            sender.sendall(b'BEAT\n')
+            self.assertEqual(bytes(decoder.receive(receiver)), b'BEAT\n')
+        finally:
+            receiver.close()
+            sender.close()
+        snapshot = profiler.snapshot()
+        self.assertEqual(snapshot[profiling.WAIT]['count'], 2)
+        self.assertGreaterEqual(snapshot[profiling.WAIT]['max_ns'], 0.04e9)
+        self.assertEqual(snapshot[profiling.READ]['count'], 1)
+
+    def test_wait_high_file_descriptor(self):
+        """Test waiting for data on a socket with a descriptor above 1023."""
+        try:
+            import resource
+        except ImportError:
+            self.skipTest('No resource limits')
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 1100:
+            self.skipTest('Too few file descriptors')
+        decoder = pilight.MessageDecoder(profiler=profiling.Profiler())
+        receiver, sender = socket.socketpair()
+        high = socket.socket(fileno=os.dup2(receiver.fileno(), 1100))
+        try:
+            high.settimeout(1)
+            sender.sendall(b'BEAT\n')
+            self.assertEqual(bytes(decoder.receive(high)), b'BEAT\n')
+            high.settimeout(0.05)
+            with self.assertRaises(socket.timeout):
+                decoder.receive(high)
+        finally:
+            high.close()
+            receiver.close()
+            sender.close()
+
+    def test_client_profiling(self):
+        """Test that all stages of the client are timed and sampled."""
+        folder = tempfile.mkdtemp()
+        profiler = profiling.Profiler(sample=1)
+        try:
+            with pilight_daemon.PilightDaemon(send_codes=True):
+                pilight_client = pilight.Client(host=pilight_daemon.HOST,
+                                                port=pilight_daemon.PORT,
+                                                profiler=profiler)
+                pilight_client.set_callback(lambda _: None)
+                pilight_client.start()
+                pilight_client.send_code(data={'protocol': 'daycom'})
+                self.assertTrue(pilight_client.heartbeat())
+                time.sleep(0.5)
+                pilight_client.stop()
+                pilight_client.join()
+
+            self.assertEqual(set(profiler.snapshot()), set(profiling.STAGES))
+            self.assertGreater(profiler.samples, 0)
+            path = os.path.join(folder, 'client.prof')
+            profiler.dump(path)
+            self.assertTrue(pstats.Stats(path).total_calls)
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Tests the record and replay of received code streams."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pilight import pilight, record
+from pilight.test import pilight_daemon
+
+
+class TestRecord(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'capture.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_capture(self):
+        """Test writing, continuing and reading a log."""
+        with record.Recorder(self.path) as recorder:
+            recorder.write(b'{"repeats": 1}\n', timestamp=1.)
+        with record.Recorder(self.path) as recorder:
+            recorder.write(b'{"repeats": 2}\n', timestamp=2.)
+        with open(self.path, 'ab') as out_file:  # Interrupted write
+            out_file.write(record.RECORD.pack(3., 100) + b'{')
+
+        self.assertEqual(list(record.Capture(self.path)),
+                         [(1., b'{"repeats": 1}\n'), (2., b'{"repeats": 2}\n')])
+
+        with open(self.path, 'wb') as out_file:
+            out_file.write(b'no record file')
+        with self.assertRaises(ValueError):
+            record.Recorder(self.path)
+        with self.assertRaises(ValueError):
+            list(record.Capture(self.path))
+
+    def test_play(self):
+        """Test the timing of the replay."""
+        with record.Recorder(self.path) as recorder:
+            for timestamp in range(5):
+                recorder.write(b'data', timestamp=timestamp * 0.1)
+        played = []
+        start = time.time()
+        self.assertEqual(record.play(self.path, played.append), 5)
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        start = time.time()
+        record.play(self.path, played.append, speed=None)
+        self.assertLess(time.time() - start, 0.1)
+        self.assertEqual(played, [b'data'] * 10)
+
+    def test_record_client(self):
+        """Test that a replay passes the recorded codes to the callback."""
+        received, replayed = [], []
+        recorder = record.Recorder(self.path)
+        with pilight_daemon.PilightDaemon(send_codes=True):
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            recorder=recorder)
+            pilight_client.set_callback(received.append)
+            pilight_client.start()
+            time.sleep(1)
+            pilight_client.stop()
+            pilight_client.join()
+            recorder.close()
+
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            pilight_client.set_callback(replayed.append)
+            record.play(self.path, pilight_client.feed, speed=None)
+
+        self.assertTrue(received)
+        self.assertEqual(replayed, received)
@@ -0,0 +1,74 @@
+"""Tests the scheduling of codes to send."""
+
+import time
+import unittest
+
+from pilight import pilight, schedule
+from pilight.test import pilight_daemon
+
+
+def _code(device_id, state='on'):
+    return {"protocol": ["daycom"], "id": device_id, "unit": 0, state: 1}
+
+
+class TestScheduler(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def test_coalesce_priorities(self):
+        """Test that pending codes are coalesced and send by priority."""
+        with pilight_daemon.PilightDaemon() as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            scheduler = schedule.Scheduler(pilight_client, rate=5)
+            scheduler.start()
+            scheduler.submit(_code(0)).result()  # Uses the burst
+            on = scheduler.submit(_code(1), priority=schedule.LOW)
+            scheduler.submit(_code(2))
+            off = scheduler.submit(_code(1, 'off'), priority=schedule.LOW)
+            scheduler.submit(_code(3), priority=schedule.HIGH)
+            self.assertIs(on, off)
+            self.assertEqual(pilight_client.metrics.snapshot()['gauges']['scheduled'], 3)
+            scheduler.stop()
+            pilight_client.stop()
+            sent = [my_daemon.get_data()['code'] for _ in range(4)]
+
+        self.assertTrue(off.result())
+        self.assertEqual(sent, [_code(0), _code(3), _code(2), _code(1, 'off')])
+        self.assertEqual((scheduler.submitted, scheduler.coalesced, scheduler.sent), (5, 1, 4))
+        self.assertEqual(pilight_client.metrics.snapshot()['counters']['codes_coalesced'], 1)
+
+    def test_rate(self):
+        """Test that codes are send with the rate after the burst."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            scheduler = schedule.Scheduler(pilight_client, rate=20, burst=2, key=None)
+            scheduler.start()
+            start = time.time()
+            results = [scheduler.submit(_code(1)) for _ in range(12)]
+            self.assertTrue(all(result.result() for result in results))
+            self.assertGreater(time.time() - start, 0.45)
+            scheduler.stop()
+            pilight_client.stop()
+        self.assertEqual(scheduler.sent, 12)
+
+    def test_send_code_fail(self):
+        """Tests that failed and invalid codes raise."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            scheduler = schedule.Scheduler(pilight_client)
+            with self.assertRaises(RuntimeError):  # Not started
+                scheduler.submit(_code(1))
+            scheduler.start()
+            with self.assertRaises(IOError):  # Daemon simulation only sends daycom
+                scheduler.send_code({"protocol": ["kaku_switch"], "id": 1, "unit": 0, "on": 1})
+            with self.assertRaises(ValueError):
+                scheduler.submit({"id": 1})
+            with self.assertRaises(ValueError):
+                scheduler.submit(_code(1), priority=5)
+            scheduler.stop()
+            pilight_client.stop()
+        self.assertEqual(scheduler.failed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests the cache of the device states."""
+
+import time
+import unittest
+
+from pilight import pilight, state
+from pilight.test import pilight_daemon
+
+
+class TestStateStore(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def test_update(self):
+        """Test the states of all message types and the device lookup."""
+        states = state.StateStore()
+        self.assertIsNone(states.get('switch'))
+        self.assertIsNone(states.age('switch'))
+        self.assertTrue(states.update({"origin": "update", "type": 1, "devices": ["switch"],
+                                       "values": {"state": "on", "timestamp": 1}}, now=1))
+        self.assertEqual(states.get('switch'), state.State({"state": "on"}, 1))
+
+        # The configuration indexes the device by the key of its codes
+        states.update({"message": "config",
+                       "config": {"devices": pilight_daemon.DEVICES}}, now=2)
+        self.assertEqual(states.get('switch'), state.State({"state": "off"}, 2))
+        self.assertIs(states.get(('kaku_switch', 0, 0)), states.get('switch'))
+        self.assertEqual(len(states), 1)
+
+        states.update(pilight_daemon.FAKE_DATA, now=3)
+        self.assertEqual(states.get('switch').values, {"state": "off", "off": 1})
+        states.update({"message": "values",
+                       "values": [{"type": 1, "devices": ["switch"],
+                                   "values": {"state": "on"}}]}, now=4)
+        self.assertEqual(states.get('switch').values, {"state": "on", "off": 1})
+        self.assertEqual(states.age('switch', now=10), 6)
+
+        self.assertFalse(states.update({"status": "success"}))
+        self.assertEqual(states.updates, 4)
+        self.assertEqual(states.devices(), ['switch'])
+
+    def test_client_states(self):
+        """Test that the client keeps the states of the daemon."""
+        states = state.StateStore()
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT,
+                                            states=states, prefilter=True)
+            pilight_client.set_callback(lambda _: None)
+            pilight_client.start()
+            time.sleep(0.2)
+            self.assertEqual(states.get(('kaku_switch', 0, 0)).values, {"state": "off"})
+            # The daemon broadcasts the update of the device to the receiver
+            control = pilight_client.request('control', code={"device": "switch", "state": "on"})
+            self.assertEqual(control.result(timeout=1), {"status": "success"})
+            time.sleep(0.2)
+            self.assertEqual(states.get('switch').values, {"state": "on"})
+            self.assertLess(states.age('switch'), 1)
+            pilight_client.stop()
+            pilight_client.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""Tests the validation of codes before sending."""
+
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pilight import pilight, validators
+from pilight.test import pilight_daemon
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'scripts', 'create_validators.py')
+
+# Protocol source as in libs/pilight/protocols/433.92/kaku_switch.c of pilight
+KAKU_SWITCH = r'''
+void kakuSwitchInit(void) {
+	protocol_register(&kaku_switch);
+	protocol_set_id(kaku_switch, "kaku_switch");
+	protocol_device_add(kaku_switch, "kaku_switch", "KlikAanKlikUit Switches");
+	kaku_switch->devtype = SWITCH;
+
+	options_add(&kaku_switch->options, "t", "on", OPTION_NO_VALUE, DEVICES_STATE, JSON_STRING, NULL, NULL);
+	options_add(&kaku_switch->options, "f", "off", OPTION_NO_VALUE, DEVICES_STATE, JSON_STRING, NULL, NULL);
+	options_add(&kaku_switch->options, "u", "unit", OPTION_HAS_VALUE, DEVICES_ID, JSON_NUMBER, NULL, "^([0-9]{1}|[1][0-5])$");
+	options_add(&kaku_switch->options, "i", "id", OPTION_HAS_VALUE, DEVICES_ID, JSON_NUMBER, NULL, "^([0-9]{1,7}|[1-5][0-9]{7}|6([0-6][0-9]{6}|7(0[0-9]{5}|10([0-7][0-9]{3}|8([0-7][0-9]{2}|8([0-5][0-9]|6[0-3]))))))$");
+	options_add(&kaku_switch->options, "a", "all", OPTION_OPT_VALUE, DEVICES_OPTIONAL, JSON_NUMBER, NULL, NULL);
+	options_add(&kaku_switch->options, "l", "learn", OPTION_NO_VALUE, DEVICES_OPTIONAL, JSON_NUMBER, NULL, NULL);
+
+	options_add(&kaku_switch->options, "0", "readonly", OPTION_HAS_VALUE, GUI_SETTING, JSON_NUMBER, (void *)0, "^[10]{1}$");
+	options_add(&kaku_switch->options, "0", "confirm", OPTION_HAS_VALUE, GUI_SETTING, JSON_NUMBER, (void *)0, "^[10]{1}$");
+}
+'''
+
+TABLE = {"version": validators.TABLE_VERSION,
+         "source": "test",
+         "protocols": {
+             "kaku_switch": {
+                 "id": ["number", "^([0-9]{1,7}|[1-5][0-9]{7}|6([0-6][0-9]{6}|7(0[0-9]{5}|10([0-7][0-9]{3}|8([0-7][0-9]{2}|8([0-5][0-9]|6[0-3]))))))$"],
+                 "unit": ["number", "^([0-9]{1}|[1][0-5])$"],
+                 "on": ["none", None],
+                 "off": ["none", None]},
+             "daycom": {
+                 "id": ["number", "^([0-9]{1,5})$"],
+                 "label": ["string", None]}}}
+
+
+class TestValidators(unittest.TestCase):
+
+    """Initialize unit test case."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.table_file = os.path.join(self.folder, 'protocols.json')
+        with open(self.table_file, 'w') as out_file:
+            json.dump(TABLE, out_file)
+        self.table = validators.load(self.table_file)
+
+    def tearDown(self):
+        validators.load()  # Restore shipped table
+        shutil.rmtree(self.folder)
+
+    def test_shipped_table(self):
+        """Test that the shipped table can be loaded."""
+        self.assertIsInstance(validators.load(), dict)
+
+    def test_shipped_kaku_switch(self):
+        """Test that a client with the shipped table rejects a malformed
+        kaku_switch code without sending it."""
+        if 'kaku_switch' not in validators.load():
+            self.skipTest('Shipped table is not created from the pilight sources')
+        with pilight_daemon.PilightDaemon(port=0) as my_daemon:
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=my_daemon.port)
+            for code in ({"protocol": ["kaku_switch"], "id": 1, "unit": 16, "on": 1},
+                         {"protocol": ["kaku_switch"], "id": "one", "unit": 0, "on": 1},
+                         {"protocol": ["kaku_switch"], "id": 1, "unit": 0, "dim": 1}):
+                with self.assertRaises(ValueError):
+                    pilight_client.send_code(data=code)
+            pilight_client.stop()
+            self.assertEqual(pilight_client.metrics.snapshot()['counters'].get('codes_sent', 0), 0)
+
+    def test_table_version(self):
+        """Test that tables of other versions are rejected."""
+        with open(self.table_file, 'w') as out_file:
+            json.dump(dict(TABLE, version=0), out_file)
+        with self.assertRaises(ValueError):
+            validators.load(self.table_file)
+
+    def test_validate(self):
+        """Test validation of valid and invalid codes."""
+        validators.validate({"protocol": ["kaku_switch"], "id": 1, "unit": 0, "off": 1})
+        validators.validate({"protocol": "daycom", "id": "12", "label": "test"})
+        # Protocols not in the table are not checked
+        validators.validate({"protocol": ["unknown"], "anything": 1})
+        for code in ({"protocol": ["kaku_switch"], "id": 1, "unit": 16},
+                     {"protocol": ["kaku_switch"], "id": "one"},
+                     {"protocol": ["kaku_switch"], "id": 1, "dim": 1}):
+            with self.assertRaises(ValueError):
+                validators.validate(code)
+
+    def test_client_validation(self):
+        """Test that invalid codes are not send."""
+        with pilight_daemon.PilightDaemon():
+            pilight_client = pilight.Client(host=pilight_daemon.HOST, port=pilight_daemon.PORT)
+            with self.assertRaises(ValueError):
+                pilight_client.send_code(data={'protocol': 'daycom', 'id': 123456})
+            pilight_client.send_code(data={'protocol': 'daycom', 'id': 12})
+
+            pilight_client.validate_codes = False
+            pilight_client.send_code(data={'protocol': 'daycom', 'id': 123456})
+
+
+class TestCreateValidators(unittest.TestCase):
+
+    """Tests the parser of the pilight protocol sources."""
+
+    @classmethod
+    def setUpClass(cls):
+        spec = importlib.util.spec_from_file_location('create_validators', SCRIPT)
+        cls.script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.script)
+
+    def test_parse_option(self):
+        """Test the options of pilight 8 (string id) and older (char id)."""
+        self.assertEqual(self.script.parse_option(
+            'options_add(&kaku_switch->options, "u", "unit", OPTION_HAS_VALUE, DEVICES_ID, '
+            'JSON_NUMBER, NULL, "^([0-9]{1}|[1][0-5])$");'),
+            {"unit": ["number", "^([0-9]{1}|[1][0-5])$"]})
+        self.assertEqual(self.script.parse_option(
+            "options_add(&kaku_switch->options, 't', \"on\", OPTION_NO_VALUE, DEVICES_STATE, "
+            "JSON_STRING, NULL, NULL);"), {"on": ["none", None]})
+        # Escaped and concatenated literals, a default that is a string
+        self.assertEqual(self.script.parse_option(
+            'options_add(&p->options, "0", "ip", OPTION_HAS_VALUE, DEVICES_ID, JSON_STRING, '
+            '(void *)"0.0.0.0", "^[0-9]{1,3}(\\\\.[0-9]{1,3}){3}"\n\t"$");'),
+            {"ip": ["string", r"^[0-9]{1,3}(\.[0-9]{1,3}){3}$"]})
+        with self.assertRaises(ValueError):
+            self.script.parse_option('options_add(&p->options, "0", "x", OPTION_HAS_VALUE);')
+
+    def test_parse_protocol(self):
+        """Test that the table of a protocol source matches the test table."""
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'kaku_switch.c')
+        try:
+            with open(path, 'w') as out_file:
+                out_file.write(KAKU_SWITCH)
+            protocols = self.script.parse_protocol(path)
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(list(protocols), ['kaku_switch'])
+        options = protocols['kaku_switch']
+        self.assertNotIn('readonly', options)  # GUI setting
+        self.assertEqual(options['all'], ['number', None])
+        for option, value in TABLE['protocols']['kaku_switch'].items():
+            self.assertEqual(options[option], value)
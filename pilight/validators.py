@@ -0,0 +1,91 @@
+"""This module validates codes before they are send to the pilight-daemon.
+
+The validator table is created from the pilight protocol sources by
+scripts/create_validators.py and shipped as protocols.json. It is loaded
+on first use. Checking a code only needs dictionary lookups, thus
+malformed codes are rejected without a round trip to the daemon.
+"""
+
+import json
+import os
+import re
+import threading
+
+# Version of the table format, tables of other versions are not used
+TABLE_VERSION = 1
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'protocols.json')
+
+_TABLE = None  # Protocol name -> option name -> (value type, regex)
+_LOCK = threading.Lock()
+
+
+def load(path=TABLE_FILE):
+    """Load and use the validator table of the file.
+
+    :returns: The validator table
+    """
+    global _TABLE  # pylint: disable=global-statement
+    with open(path, 'r') as in_file:
+        content = json.load(in_file)
+    if content.get('version') != TABLE_VERSION:
+        raise ValueError('Validator table %s has version %s, expected %d' %
+                         (path, content.get('version'), TABLE_VERSION))
+    table = {}
+    for protocol, options in content['protocols'].items():
+        table[protocol] = dict(
+            (option, (value_type, re.compile(regex) if regex else None))
+            for option, (value_type, regex) in options.items())
+    _TABLE = table
+    return table
+
+
+def get_table():
+    """Return the validator table, loaded on first use."""
+    if _TABLE is None:
+        with _LOCK:
+            if _TABLE is None:
+                load()
+    return _TABLE
+
+
+def _check_value(protocol, option, value, value_type, regex):
+    if value_type == 'number':
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            try:
+                float(value)
+            except (TypeError, ValueError):
+                raise ValueError('Option %s of protocol %s has to be a number'
+                                 ', not %r' % (option, protocol, value))
+    if regex is not None and not regex.match(str(value)):
+        raise ValueError('Option %s of protocol %s has an invalid value %r' %
+                         (option, protocol, value))
+
+
+def validate(data, table=None):
+    """Raise ValueError if the code is invalid for its protocols.
+
+    Protocols that are not in the table are not checked, the
+    pilight-daemon has to decide about them.
+    :param data: Dictionary with the code data as used by send_code
+    :param table: Validator table, default is the shipped table
+    """
+    if table is None:
+        table = get_table()
+    protocols = data['protocol']
+    if not isinstance(protocols, (list, tuple)):
+        protocols = (protocols, )
+    known = [protocol for protocol in protocols if protocol in table]
+    if not known:
+        return
+    for option, value in data.items():
+        if option == 'protocol':
+            continue
+        for protocol in known:
+            if option in table[protocol]:
+                value_type, regex = table[protocol][option]
+                _check_value(protocol, option, value, value_type, regex)
+                break
+        else:
+            raise ValueError('Option %s is unknown for protocol %s' %
+                             (option, ', '.join(known)))
@@ -0,0 +1,208 @@
+''' This script benchmarks the pilight client against the daemon simulation.
+
+    The simulation of the pilight-daemon (pilight/test/pilight_daemon.py)
+    runs in its own process, thus it does not compete with the client
+    for the interpreter. Measured are:
+
+        - send_code throughput and acknowledgement latency percentiles
+        - send_codes (pipelined) throughput
+        - receive throughput at the given code rates
+        - latency from sending a code in the daemon to the callback
+        - threads and memory per started client
+
+    The results are written as JSON and can be compared to the results
+    of another version. Run it in the repository root:
+
+        PYTHONPATH=. python scripts/benchmark.py -o old.json
+        PYTHONPATH=. python scripts/benchmark.py -o new.json --compare old.json
+'''
+
+import argparse
+import json
+import multiprocessing
+import platform
+import threading
+import time
+import tracemalloc
+
+from pilight import codec, pilight
+from pilight.test import pilight_daemon
+
+
+
+def timestamped_code(number):
+    ''' Code with the send time to measure the latency to the callback. '''
+    code = pilight_daemon.fake_code(number)
+    code['message'] = dict(code['message'], id=number, sent=time.time())
+    return code
+
+
+def serve(daemon_kwargs, ports, stop):
+    with pilight_daemon.PilightDaemon(port=0, **daemon_kwargs) as daemon:
+        ports.put(daemon.port)
+        stop.wait()
+
+
+class Simulation(object):
+    ''' Pilight-daemon simulation on a free port in a child process. '''
+
+    def __init__(self, **daemon_kwargs):
+        self.port = None
+        self._ports = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._process = multiprocessing.Process(
+            target=serve, args=(daemon_kwargs, self._ports, self._stop))
+
+    def __enter__(self):
+        self._process.start()
+        self.port = self._ports.get(timeout=30)
+        return self
+
+    def __exit__(self, *_):
+        self._stop.set()
+        self._process.join()
+
+
+def percentiles(values):
+    ''' Return percentiles of the values in milliseconds. '''
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def at(fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))] * 1e3
+
+    return {'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99),
+            'max_ms': values[-1] * 1e3}
+
+
+def bench_send(codes):
+    ''' Sequential send_code calls, each waits for its acknowledgement. '''
+    latencies = []
+    with Simulation() as simulation:
+        client = pilight.Client(port=simulation.port, heartbeat_interval=None)
+        start = time.perf_counter()
+        for _ in range(codes):
+            send_start = time.perf_counter()
+            client.send_code({'protocol': 'daycom'})
+            latencies.append(time.perf_counter() - send_start)
+        duration = time.perf_counter() - start
+        client.stop()
+    result = {'codes': codes, 'codes_per_sec': codes / duration}
+    result.update(percentiles(latencies))
+    return result
+
+
+def bench_send_pipelined(codes, batch=100):
+    ''' Codes send with send_codes in batches. '''
+    with Simulation() as simulation:
+        client = pilight.Client(port=simulation.port, heartbeat_interval=None)
+        start = time.perf_counter()
+        for _ in range(codes // batch):
+            if not all(client.send_codes([{'protocol': 'daycom'}] * batch)):
+                raise RuntimeError('Codes not acknowledged')
+        duration = time.perf_counter() - start
+        client.stop()
+    return {'codes': codes // batch * batch, 'batch': batch,
+            'codes_per_sec': codes // batch * batch / duration}
+
+
+def bench_receive(rate, duration, repeats=1):
+    ''' Codes received at the code rate of the daemon. '''
+    latencies = []
+
+    def callback(message_dict):
+        latencies.append(time.time() - message_dict['message']['sent'])
+
+    with Simulation(code_rate=rate, repeats=repeats,
+                    code=timestamped_code) as simulation:
+        client = pilight.Client(port=simulation.port)
+        client.set_callback(callback)
+        client.start()
+        time.sleep(duration)
+        client.stop()
+        client.join()
+    result = {'rate': rate, 'repeats': repeats, 'received': len(latencies),
+              'codes_per_sec': len(latencies) / duration}
+    result.update(percentiles(latencies))
+    return result
+
+
+def bench_footprint(clients):
+    ''' Threads and memory of started clients. '''
+    with Simulation() as simulation:
+        threads = threading.active_count()
+        tracemalloc.start()
+        started = []
+        for _ in range(clients):
+            client = pilight.Client(port=simulation.port)
+            client.set_callback(lambda _: None)
+            client.start()
+            started.append(client)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        result = {'clients': clients,
+                  'threads_per_client':
+                      (threading.active_count() - threads) / float(clients),
+                  'bytes_per_client': memory / clients}
+        for client in started:
+            client.stop()
+        for client in started:
+            client.join()
+    return result
+
+
+def run(args):
+    results = {'send': bench_send(args.codes),
+               'send_pipelined': bench_send_pipelined(args.codes)}
+    for rate in args.rates:
+        results['receive_%d' % rate] = bench_receive(rate, args.duration)
+    results['footprint'] = bench_footprint(args.clients)
+    return {'python': platform.python_version(),
+            'codec': codec.name,
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results}
+
+
+def compare(results, baseline):
+    ''' Print the relative change of each metric to the baseline. '''
+    print('%-40s %12s %12s %8s' % ('metric', 'baseline', 'current', 'change'))
+    for name, metrics in sorted(results['results'].items()):
+        old_metrics = baseline['results'].get(name, {})
+        for metric, value in sorted(metrics.items()):
+            old = old_metrics.get(metric)
+            if old is None:
+                continue
+            change = '%+.1f%%' % ((value - old) * 100. / old) if old else '-'
+            print('%-40s %12.4g %12.4g %8s' % (name + '.' + metric, old, value,
+                                              change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of baseline results')
+    parser.add_argument('--codes', type=int, default=1000,
+                        help='Number of codes to send')
+    parser.add_argument('--rates', type=int, nargs='+', default=[100, 1000],
+                        help='Code rates of the daemon in codes per second')
+    parser.add_argument('--duration', type=float, default=3,
+                        help='Seconds to receive codes at each rate')
+    parser.add_argument('--clients', type=int, default=10,
+                        help='Number of clients for the footprint')
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out_file:
+            out_file.write(text + '\n')
+    if args.compare:
+        with open(args.compare) as in_file:
+            compare(results, json.load(in_file))
+    elif not args.output:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,97 +1,179 @@
 ''' This script reverse engineers the protocols defined in pilight.
 
-    It converts them to voloptuous schemes to allow protocol validation
-    before sending data to the pilight daemon.
+    It converts the protocol options to a validator table that is shipped
+    with the package (pilight/protocols.json). The table allows protocol
+    validation before sending data to the pilight daemon.
 
-    'git' python package has to be installed.
+    Usage with a checkout of https://github.com/pilight/pilight at the
+    pinned tag, the tag is recorded as source of the table:
 
-    TODO: use regex for numbers
-'''
+        git clone --branch v8.1.5 https://github.com/pilight/pilight
+        python scripts/create_validators.py pilight
 
+    The table maps each protocol to its options. Each option has a value
+    type ('none', 'number' or 'string') and an optional regex the value
+    has to match.
+'''
 
-import re
+import argparse
 import glob
-
-import voluptuous as vol
-import git
-
-# git.Repo.clone_from(url=r'https://github.com/pilight/pilight',
-#                 to_path='pilight')
+import json
+import os
+import re
+import subprocess
+
+# Has to match pilight.validators.TABLE_VERSION
+TABLE_VERSION = 1
+# Tag of the pilight sources the shipped table is created from
+PILIGHT_TAG = 'v8.1.5'
+
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', 'pilight', 'protocols.json')
+
+# Tokens of C arguments: string and char literals, brackets, commas
+_TOKENS = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[(),]|[^"\'(),]+')
+# Comments of C code, literals are matched to keep them
+_COMMENTS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|//[^\n]*|/\*.*?\*/',
+                       re.DOTALL)
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0'}
+
+
+def _unescape(literal):
+    """Return the value of a C string or char literal."""
+    return re.sub(r'\\(.)', lambda match: _ESCAPES.get(match.group(1),
+                                                        match.group(1)),
+                  literal[1:-1])
+
+
+def parse_arguments(call):
+    """Return the arguments of a C function call, e.g. options_add(...).
+
+    String literals are unescaped, adjacent literals are concatenated.
+    Other arguments are returned as stripped source code.
+    """
+    arguments, argument, depth = [], [], 0
+    for token in _TOKENS.findall(call[call.index('('):]):
+        if token == '(':
+            depth += 1
+            if depth == 1:
+                continue
+        elif token == ')':
+            depth -= 1
+            if not depth:
+                break
+        elif token == ',' and depth == 1:
+            arguments.append(argument)
+            argument = []
+            continue
+        argument.append(token)
+    arguments.append(argument)
+
+    def value(tokens):
+        tokens = [token for token in tokens if token.strip()]
+        if tokens and all(token[0] == '"' for token in tokens):
+            return ''.join(_unescape(token) for token in tokens)
+        if len(tokens) == 1 and tokens[0][0] == "'":
+            return _unescape(tokens[0])
+        return ''.join(tokens).strip()
+    return [value(tokens) for tokens in arguments]
 
 
 def parse_option(option_string):
-    if 'OPTION_NO_VALUE' in option_string:
-        option = re.findall(r'\"(.*?)\"', option_string)[0]
+    """Return {name: [value type, regex]} of an options_add() call.
+
+    The call is options_add(&options, id, name, argument type,
+    configuration type, variable type, default, regex). The id is a char
+    in pilight < 8 and a string since.
+    """
+    arguments = parse_arguments(option_string)
+    if len(arguments) != 8:
+        raise ValueError('Cannot parse option %s' % option_string)
+    _, _, option, argtype, _, vartype, _, regex = arguments
+    if regex == 'NULL':
+        regex = None
+    if argtype == 'OPTION_NO_VALUE':
         # The options without values seem to still need a value
         # when used with pilight-daemon, but this are not mandatory
         # options
         # E.G.: option 'on' is 'on': 1
-        return {vol.Optional(option): vol.Coerce(int)}
-    elif 'OPTION_HAS_VALUE' in option_string:
-        options = re.findall(r'\"(.*?)\"', option_string)
-        option = options[0]
-        regex = None
-        if len(options) > 1:  # Option has specified value by regex
-            regex = options[1]
-        if 'JSON_NUMBER' in option_string:
-            return {vol.Required(option): vol.Coerce(int)}
-        elif 'JSON_STRING' in option_string:
-            return {vol.Required(option): vol.Coerce(str)}
-        else:
-            raise
-    elif 'OPTION_OPT_VALUE' in option_string:
-        options = re.findall(r'\"(.*?)\"', option_string)
-        option = options[0]
-        regex = None
-        if len(options) > 1:  # Option has specified value by regex
-            regex = options[1]
-        if 'JSON_NUMBER' in option_string:
-            return {vol.Required(option): vol.Coerce(int)}
-        elif 'JSON_STRING' in option_string:
-            return {vol.Required(option): vol.Coerce(str)}
-        else:
-            raise
-    else:
-        print(option_string)
-        raise
-
-    raise
+        return {option: ['none', None]}
+    elif argtype in ('OPTION_HAS_VALUE', 'OPTION_OPT_VALUE'):
+        if vartype == 'JSON_NUMBER':
+            return {option: ['number', regex]}
+        elif vartype == 'JSON_STRING':
+            return {option: ['string', regex]}
+    raise ValueError('Cannot parse option %s' % option_string)
+
+
+def _statements(in_file):
+    """Yield the statements of a C file without comments, a statement can
+    span several lines."""
+    # Omit commented code, comment markers in literals are no comments
+    source = _COMMENTS.sub(lambda match: match.group(1) or ' ',
+                           in_file.read())
+    statement = []
+    for line in source.splitlines():
+        statement.append(line.strip())
+        if line.rstrip().endswith((';', '{', '}')) or \
+                line.lstrip().startswith('#'):
+            yield ' '.join(statement)
+            statement = []
+    yield ' '.join(statement)
 
 
 def parse_protocol(file):
+    """Return {protocol id: options} of the protocol source file."""
     protocol = {}
+    p_ids = []
     with open(file, 'r') as in_file:
-        for line in in_file:
-            # Omit commented code
-            if '//' in line:
-                continue
-            # Omit GUI specific protocol settings
-            if 'GUI_SETTING' in line:
-                continue
-            # Get protocol id (= name string)
-            if 'protocol_set_id' in line:
-                p_id = line.partition('\"')[-1].rpartition('\"')[0]
+        for statement in _statements(in_file):
+            # Get protocol ids (= name strings), can be several
+            if re.search(r'\bprotocol_set_id\s*\(', statement):
+                p_ids.append(parse_arguments(statement)[1])
             # Get protocol options (key/value pairs)
-            if 'options_add' in line:
-                protocol.update(parse_option(line))
+            elif re.search(r'\boptions_add\s*\(', statement):
+                # Omit GUI specific protocol settings
+                if parse_arguments(statement)[4] == 'GUI_SETTING':
+                    continue
+                protocol.update(parse_option(statement))
 
-    return {p_id: protocol}
+    return dict((p_id, protocol) for p_id in p_ids)
 
 
-def get_protocols(path='pilight/**/433*/*.c'):
-    for filename in glob.iglob(path, recursive=True):
+def get_protocols(path):
+    pattern = os.path.join(path, 'libs', 'pilight', 'protocols', '**', '*.c')
+    for filename in glob.iglob(pattern, recursive=True):
         yield filename
 
-if __name__ == '__main__':
 
-    protocols = None
-    for protocol in get_protocols():
-        if not protocols:
-            # , extra=vol.ALLOW_EXTRA)
-            protocols = vol.Schema(parse_protocol(protocol),
-                                   # Allows additional protcols but
-                                   # also additional protcol keys
-                                   # HOWTO fix?
-                                   extra=vol.ALLOW_EXTRA)
-        else:
-            protocols.extend(parse_protocol(protocol))
+def get_source(path):
+    """Return the pilight version the table is created from."""
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--tags', '--always'],
+            cwd=path).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pilight', help='Path of the pilight sources')
+    parser.add_argument('-o', '--output', default=OUTPUT,
+                        help='Validator table file to create')
+    args = parser.parse_args()
+    source = get_source(args.pilight)
+    if source != PILIGHT_TAG:
+        print('Warning: pilight sources are at %s, not at %s' %
+              (source, PILIGHT_TAG))
+
+    protocols = {}
+    for protocol in get_protocols(args.pilight):
+        protocols.update(parse_protocol(protocol))
+
+    with open(args.output, 'w') as out_file:
+        json.dump({'version': TABLE_VERSION,
+                   'source': source,
+                   'protocols': protocols},
+                  out_file, indent=1, sort_keys=True)
+        out_file.write('\n')
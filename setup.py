@@ -17,6 +17,7 @@ setup(
     author_email=author_email,
     maintainer_email=author_email,
     packages=find_packages(),
+    python_requires='>=3.7',  # time.perf_counter_ns
     include_package_data=True,  # Accept all data files and directories matched by MANIFEST.in or found in source control
     keywords=['pilight', '433', 'light'],
     platforms='any'